@@ -1,4 +1,7 @@
 from Models.BP.bp_layers import bp_layers
+from results import record_dynamics
+from checkpoint import writer
+from evaluate import evaluate, RunningMetrics
 
 import torch
 from torch import nn
@@ -30,23 +33,11 @@ class bp_net(nn.Module):
             x = layer(x)  # Call the forward method of each layer
         return x
 
-    def calculate_accuracy(self, loader):
-        """Calculates accuracy on the given data loader."""
-        correct = 0
-        total = 0
-        with torch.no_grad():
-            for x, y in loader:
-                x, y = x.to(self.device), y.to(self.device)
-                y_pred = self(x)
-                _, predicted = torch.max(y_pred.data, 1)
-                total += y.size(0)
-                correct += (predicted == y).sum().item()
-        return correct / total
-
     def train_model(self, train_loader, valid_loader, epochs, lr, log, save, 
-                    trial = 0, new_ckpt= '',train_ckpts = ''):
+                    trial = 0, new_ckpt= '',train_ckpts = '', train_metrics = 'exact'):
         if self.opt == False:
             self.optimizer = torch.optim.SGD(self.parameters(), lr=lr)
+            self.opt = True # later tasks continue with this optimizer
         # optimizer = torch.optim.Adam(self.parameters(), lr=lr)
         #### for epoch 0
         epoch = 0
@@ -59,19 +50,12 @@ class bp_net(nn.Module):
         test_accuracies = []
         eps = []
         
-        initial_train_loss = 0
-        for x, y in train_loader:
-            x, y = x.to(self.device), y.to(self.device)
-            y_pred = self(x)
-            loss = self.loss_function(y_pred, y)
-            initial_train_loss += loss.item()
-        
-        initial_train_loss /= len(train_loader.dataset)
-        initial_train_acc = self.calculate_accuracy(train_loader)
-
-        # Evaluate the model on the validation set before training starts (epoch 0)
+        # loss, accuracy, confusion matrix and calibration in one pass over each set
         self.eval()
-        initial_test_loss, initial_test_acc = self.external_test(valid_loader)
+        initial_train = evaluate(self, train_loader, self.loss_function, device=self.device)
+        initial_test = evaluate(self, valid_loader, self.loss_function, device=self.device)
+        initial_train_loss, initial_train_acc = initial_train.loss, initial_train.accuracy
+        initial_test_loss, initial_test_acc = initial_test.loss, initial_test.accuracy
         
         train_losses.append(initial_train_loss)
         train_accuracies.append(initial_train_acc)
@@ -91,7 +75,8 @@ class bp_net(nn.Module):
                 "train loss": initial_train_loss,
                 "train accuracy": initial_train_acc,
                 "valid loss": initial_test_loss,
-                "valid accuracy": initial_test_acc
+                "valid accuracy": initial_test_acc,
+                "valid calibration error": initial_test.calibration_error
             })
         
         print(f"Epoch: {epoch}, Train Acc {initial_train_acc}, Valid Acc: {initial_test_acc}")
@@ -99,7 +84,8 @@ class bp_net(nn.Module):
         # Training loop starts at epoch 1
         for epoch in range(1, epochs + 1):
             self.train()  # Set the model to training mode
-            total_train_loss = 0
+            # 'online': train metrics from the outputs of the training steps, 'exact': a pass after the epoch
+            running = RunningMetrics() if train_metrics == 'online' else None
 
             # Training phase
             for x, y in train_loader:
@@ -109,13 +95,19 @@ class bp_net(nn.Module):
                 loss = self.loss_function(y_pred, y)
                 loss.backward()
                 self.optimizer.step()
-                total_train_loss += loss.item()
+                if running is not None:
+                    running.update(y_pred, y, loss)
 
-            train_loss = total_train_loss / len(train_loader.dataset)
-            train_acc = self.calculate_accuracy(train_loader)  # Calculate training accuracy
+            self.eval()
+            if running is not None:
+                train_loss, train_acc = running.result()
+            else:
+                train = evaluate(self, train_loader, self.loss_function, device=self.device)
+                train_loss, train_acc = train.loss, train.accuracy
 
             # testing phase
-            test_loss, test_acc = self.external_test(valid_loader)  # Calculate validation loss and accuracy
+            test = evaluate(self, valid_loader, self.loss_function, device=self.device)
+            test_loss, test_acc = test.loss, test.accuracy
 
             train_losses.append(train_loss)
             train_accuracies.append(train_acc)
@@ -130,7 +122,8 @@ class bp_net(nn.Module):
                     "train loss": train_loss,
                     "train accuracy": train_acc,
                     "valid loss": test_loss,
-                    "valid accuracy": test_acc
+                    "valid accuracy": test_acc,
+                    "valid calibration error": test.calibration_error
                 })
             print(f"Epoch: {epoch},  Train Acc: {train_acc}, Valid Acc: {test_acc}")
 
@@ -148,13 +141,16 @@ class bp_net(nn.Module):
     # def load_state(self, path):
     #     self.load_state_dict(torch.load(path))
  
+    def checkpoint(self):
+        return {
+            'model_state_dict': self.state_dict(),
+            'optimizer_state_dict': self.optimizer.state_dict(),
+        }
+
     def save_model(self, new_ckpt):
         path = new_ckpt
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        torch.save({
-            'model_state_dict': self.state_dict(),
-            'optimizer_state_dict': self.optimizer.state_dict(),
-        }, path)
+        writer.save(self.checkpoint(), path)
 
 
     def save_initial_results(self, train_loss, train_acc, valid_loss, valid_acc, trial, ckpt):
@@ -187,58 +183,21 @@ class bp_net(nn.Module):
             json.dump(data, file, indent=4)
 
     def save_training_dynamics(self, train_losses, train_accuracies, test_losses, test_accuracies, trial, ckpt):
-        path = ckpt
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-
-        # Check if the file exists and has content
-        if os.path.exists(path) and os.path.getsize(path) > 0:
-            with open(path, "r") as file:
-                data = json.load(file)
-        else:
-            # Initialize the dictionary with lists to store results
-            data = [{
-                "Trial": [],
-                "Train Losses": [],
-                "Train Accuracies": [],
-                "Test Losses": [],
-                "Test Accuracies": []
-            }]
-
-        # Append new results to each list within the first dictionary entry
-        data[0]["Trial"].append(trial)
-        data[0]["Train Losses"].append(train_losses)
-        data[0]["Train Accuracies"].append(train_accuracies)
-        data[0]["Test Losses"].append(test_losses)
-        data[0]["Test Accuracies"].append(test_accuracies)
-
-        # Write the updated dictionary back to the file
-        with open(path, "w") as file:
-            json.dump(data, file, indent=4)
+        record_dynamics(ckpt, trial, {
+            "train_loss": train_losses,
+            "train_accuracy": train_accuracies,
+            "test_loss": test_losses,
+            "test_accuracy": test_accuracies
+        })
 
 #---------------------------------------------------
 
     def load_state(self, path, lr):
-        checkpoint = torch.load(path)
+        self.load_checkpoint(torch.load(path), lr)
+
+    def load_checkpoint(self, checkpoint, lr):
         self.load_state_dict(checkpoint['model_state_dict'])
         # Initialize the optimizer here with the current model parameters
         self.optimizer = torch.optim.SGD(self.parameters(), lr=lr)
         self.opt = True
         self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
-
-    def external_test(self, test_loader):
-        """Tests the model on the given data loader and returns loss and accuracy."""
-        self.eval()  # Set the model to evaluation mode
-        loss = 0
-        correct = 0
-        total = 0
-        with torch.no_grad():
-            for x, y in test_loader:
-                x, y = x.to(self.device), y.to(self.device)
-                y_pred = self(x)
-                loss += self.loss_function(y_pred, y).item()
-                _, predicted = torch.max(y_pred.data, 1)
-                total += y.size(0)
-                correct += (predicted == y).sum().item()
-        accuracy = correct / total
-        # Normalize the test loss by the total number of samples
-        return loss / total, accuracy
\ No newline at end of file
@@ -106,13 +106,16 @@ class EnergyBasedModel(abc.ABC, torch.nn.Module):
         self.clamp_du[i] = False
         self.update_energy()
 
-    def reset_state(self):
+    def reset_state(self, batch_size=None):
         """
         Reset the state of the system to a random (Normal) configuration.
+
+        Args:
+            batch_size: Number of samples of the next batch, self.batch_size by default
         """
         self.u = []
         for i in range(self.n_layers):
-            self.u.append(torch.randn((self.batch_size, self.dimensions[i]),
+            self.u.append(torch.randn((batch_size or self.batch_size, self.dimensions[i]),
                                       requires_grad=not(self.clamp_du[i]),
                                       device=self.device))
         self.update_energy()
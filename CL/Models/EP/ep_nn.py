@@ -26,9 +26,13 @@ import torch
 import os
 import json
 import wandb
+from contextlib import nullcontext
 
 from Models.EP.ep_fcns import CEnergy, CrossEntropy, SquaredError, create_cost, create_activations, create_optimizer
 from Models.EP.ep_layers import RestrictedHopfield, ConditionalGaussian
+from results import record_dynamics
+from checkpoint import writer
+from evaluate import evaluate
 
 
 class ep_net:
@@ -48,30 +52,28 @@ class ep_net:
         
 
     def predict_batch(self, x_batch, dynamics, fast_init):
-        self.model.reset_state()
-        self.model.clamp_layer(0, x_batch.view(-1, self.model.dimensions[0]))
-        self.model.set_C_target(None)
-        if fast_init:
-            self.model.fast_init()
-        else:
-            self.model.u_relax(**dynamics)
+        # the relaxation follows the gradient of the energy, so it needs autograd also when evaluating under no_grad
+        with torch.enable_grad() if not fast_init else nullcontext():
+            # release the target first, it may belong to a batch of another size
+            self.model.set_C_target(None)
+            self.model.reset_state(len(x_batch))
+            self.model.clamp_layer(0, x_batch.view(-1, self.model.dimensions[0]))
+            if fast_init:
+                self.model.fast_init()
+            else:
+                self.model.u_relax(**dynamics)
         return torch.nn.functional.softmax(self.model.u[-1].detach(), dim=1)
 
     def test_model(self, test_loader, dynamics, fast_init):
-        test_E, correct, total = 0.0, 0.0, 0.0
-        for x_batch, y_batch in test_loader:
-            x_batch, y_batch = x_batch.to(self.device), y_batch.to(self.device)
-            output = self.predict_batch(x_batch, dynamics, fast_init)
-            prediction = torch.argmax(output, 1)
-            with torch.no_grad():
-                correct += float(torch.sum(prediction == y_batch.argmax(dim=1)))
-                test_E += float(torch.sum(self.model.E))
-                total += x_batch.size(0)
-        return correct / total, test_E / total
+        # the energy of the relaxed state is reported as the loss
+        metrics = evaluate(lambda x_batch: self.predict_batch(x_batch, dynamics, fast_init), test_loader,
+                           lambda output, y_batch: torch.sum(self.model.E), probabilities=True, device=self.device)
+        return metrics.accuracy, metrics.loss
 
     def train_model(self, train_loader, valid_loader, epochs, dynamics, lr = 0.01, fast_init = True, log=False, save=False, trial=0, new_ckpt='', train_ckpts=''):
         if self.opt == False:
             self.optimizer = create_optimizer(self.model, "adam",  lr=lr) # options: sgd, adam, adagrad
+            self.opt = True
         epoch = 0
         test_accs = []
         test_acc, test_E = self.test_model(valid_loader, dynamics, fast_init)
@@ -87,7 +89,7 @@ class ep_net:
                 x_batch, y_batch = x_batch.to(self.device), y_batch.to(self.device)
                 
                 # reinitialize the neural state variables
-                self.model.reset_state()
+                self.model.reset_state(len(x_batch))
                 # input just the training sample
                 self.model.clamp_layer(0, x_batch.view(-1, self.model.dimensions[0]))
 
@@ -119,42 +121,25 @@ class ep_net:
             self.save_model(new_ckpt)
             # self.save_training_dynamics(train_loader, valid_loader, trial, train_ckpts)
 
-    def save_model(self, path="checkpoints/EP/params.pth"):
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        torch.save({
+    def checkpoint(self):
+        return {
             'model_state_dict': self.model.state_dict(),
             'optimizer_state_dict': self.optimizer.state_dict(),
-        }, path)
+        }
+
+    def save_model(self, path="checkpoints/EP/params.pth"):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        writer.save(self.checkpoint(), path)
 
     def load_state(self, path, lr):
-        checkpoint = torch.load(path)
+        self.load_checkpoint(torch.load(path), lr)
+
+    def load_checkpoint(self, checkpoint, lr):
         self.model.load_state_dict(checkpoint['model_state_dict'])
         self.optimizer = create_optimizer(self.model, "adam", lr=lr)
         self.opt = True
         self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
 
     def save_training_dynamics(self, test_accuracies, trial, ckpt):
-        path = ckpt
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-
-        if os.path.exists(path) and os.path.getsize(path) > 0:
-            with open(path, "r") as file:
-                data = json.load(file)
-        else:
-            data = [{
-                "Trial": [],
-                # "Train Losses": [],
-                # "Train Accuracies": [],
-                # "Test Losses": [],
-                "Test Accuracies": []
-            }]
-
-        data[0]["Trial"].append(trial)
-        # data[0]["Train Losses"].append(train_losses)
-        # data[0]["Train Accuracies"].append(train_accuracies)
-        # data[0]["Test Losses"].append(test_losses)
-        data[0]["Test Accuracies"].append(test_accuracies)
-
-        with open(path, "w") as file:
-            json.dump(data, file, indent=4)
+        record_dynamics(ckpt, trial, {"test_accuracy": test_accuracies})
 
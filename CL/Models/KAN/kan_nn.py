@@ -29,6 +29,9 @@ import numpy as np
 import math
 
 from Models.KAN.kan_layers import KANConv2d, KANLinear2, KolmogorovActivation, KANLinearFFT, KANPreprocessing, KANLinear
+from results import record_dynamics
+from checkpoint import writer
+from evaluate import evaluate, RunningMetrics
 
 ###################### prelim fcns ######################
 @torch.jit.script
@@ -140,21 +143,10 @@ class kan_net(nn.Module):
         return x
 
 
-    def calculate_accuracy(self, loader):
-        correct = 0
-        total = 0
-        with torch.no_grad():
-            for x, y in loader:
-                x, y = x.to(self.device), y.to(self.device)
-                y_pred = self(x)
-                _, predicted = torch.max(y_pred.data, 1)
-                total += y.size(0)
-                correct += (predicted == y).sum().item()
-        return correct / total
-
-    def train_model(self, train_loader, valid_loader, epochs, lr, log, save, trial=0, new_ckpt='', train_ckpts=''):
+    def train_model(self, train_loader, valid_loader, epochs, lr, log, save, trial=0, new_ckpt='', train_ckpts='', train_metrics='exact'):
         if not self.opt:
             self.optimizer = torch.optim.AdamW(self.parameters(), lr=lr, weight_decay=0.0005)
+            self.opt = True
         epoch = 0
         self.train()
 
@@ -164,18 +156,12 @@ class kan_net(nn.Module):
         test_accuracies = []
         eps = []
         # print("Calculating initial training loss and accuracy for epoch 0")
-        initial_train_loss = 0
-        for x, y in train_loader:
-            x, y = x.to(self.device), y.to(self.device)
-            y_pred = self(x)
-            loss = self.loss_function(y_pred, y)
-            initial_train_loss += loss.item()
-        
-        initial_train_loss /= len(train_loader.dataset)
-        initial_train_acc = self.calculate_accuracy(train_loader)
-
+        # loss, accuracy, confusion matrix and calibration in one pass over each set
         self.eval()
-        initial_test_loss, initial_test_acc = self.external_test(valid_loader)
+        initial_train = evaluate(self, train_loader, self.loss_function, device=self.device)
+        initial_test = evaluate(self, valid_loader, self.loss_function, device=self.device)
+        initial_train_loss, initial_train_acc = initial_train.loss, initial_train.accuracy
+        initial_test_loss, initial_test_acc = initial_test.loss, initial_test.accuracy
 
         print(f"Epoch: {epoch}, Train Acc {initial_train_acc}, Valid Acc: {initial_test_acc}")
 
@@ -191,12 +177,14 @@ class kan_net(nn.Module):
                 "train loss": initial_train_loss,
                 "train accuracy": initial_train_acc,
                 "valid loss": initial_test_loss,
-                "valid accuracy": initial_test_acc
+                "valid accuracy": initial_test_acc,
+                "valid calibration error": initial_test.calibration_error
             })
         
         for epoch in range(1, epochs + 1):
             self.train()
-            total_train_loss = 0
+            # 'online': train metrics from the outputs of the training steps, 'exact': a pass after the epoch
+            running = RunningMetrics() if train_metrics == 'online' else None
 
             for x, y in train_loader:
                 x, y = x.to(self.device), y.to(self.device)
@@ -205,12 +193,18 @@ class kan_net(nn.Module):
                 loss = self.loss_function(y_pred, y)
                 loss.backward()
                 self.optimizer.step()
-                total_train_loss += loss.item()
+                if running is not None:
+                    running.update(y_pred, y, loss)
 
-            train_loss = total_train_loss / len(train_loader.dataset)
-            train_acc = self.calculate_accuracy(train_loader)
+            self.eval()
+            if running is not None:
+                train_loss, train_acc = running.result()
+            else:
+                train = evaluate(self, train_loader, self.loss_function, device=self.device)
+                train_loss, train_acc = train.loss, train.accuracy
 
-            test_loss, test_acc = self.external_test(valid_loader)
+            test = evaluate(self, valid_loader, self.loss_function, device=self.device)
+            test_loss, test_acc = test.loss, test.accuracy
 
             train_losses.append(train_loss)
             train_accuracies.append(train_acc)
@@ -224,7 +218,8 @@ class kan_net(nn.Module):
                     "train loss": train_loss,
                     "train accuracy": train_acc,
                     "valid loss": test_loss,
-                    "valid accuracy": test_acc
+                    "valid accuracy": test_acc,
+                    "valid calibration error": test.calibration_error
                 })
             print(f"Epoch: {epoch}, Train Acc: {train_acc}, Valid Acc: {test_acc}")
 
@@ -232,13 +227,16 @@ class kan_net(nn.Module):
             self.save_model(new_ckpt)
             self.save_training_dynamics(train_losses, train_accuracies, test_losses, test_accuracies, trial, train_ckpts)
     
+    def checkpoint(self):
+        return {
+            'model_state_dict': self.state_dict(),
+            'optimizer_state_dict': self.optimizer.state_dict(),
+        }
+
     def save_model(self, new_ckpt):
         path = new_ckpt
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        torch.save({
-            'model_state_dict': self.state_dict(),
-            'optimizer_state_dict': self.optimizer.state_dict(),
-        }, path)
+        writer.save(self.checkpoint(), path)
 
     def save_initial_results(self, train_loss, train_acc, valid_loss, valid_acc, trial, ckpt):
         path = ckpt
@@ -266,49 +264,18 @@ class kan_net(nn.Module):
             json.dump(data, file, indent=4)
 
     def save_training_dynamics(self, train_losses, train_accuracies, test_losses, test_accuracies, trial, ckpt):
-        path = ckpt
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-
-        if os.path.exists(path) and os.path.getsize(path) > 0:
-            with open(path, "r") as file:
-                data = json.load(file)
-        else:
-            data = [{
-                "Trial": [],
-                "Train Losses": [],
-                "Train Accuracies": [],
-                "Test Losses": [],
-                "Test Accuracies": []
-            }]
-
-        data[0]["Trial"].append(trial)
-        data[0]["Train Losses"].append(train_losses)
-        data[0]["Train Accuracies"].append(train_accuracies)
-        data[0]["Test Losses"].append(test_losses)
-        data[0]["Test Accuracies"].append(test_accuracies)
-
-        with open(path, "w") as file:
-            json.dump(data, file, indent=4)
+        record_dynamics(ckpt, trial, {
+            "train_loss": train_losses,
+            "train_accuracy": train_accuracies,
+            "test_loss": test_losses,
+            "test_accuracy": test_accuracies
+        })
 
     def load_state(self, path, lr):
-        checkpoint = torch.load(path)
+        self.load_checkpoint(torch.load(path), lr)
+
+    def load_checkpoint(self, checkpoint, lr):
         self.load_state_dict(checkpoint['model_state_dict'])
         self.optimizer = torch.optim.AdamW(self.parameters(), lr=lr)
         self.opt = True
         self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
-
-    def external_test(self, test_loader):
-        self.eval()
-        loss = 0
-        correct = 0
-        total = 0
-        with torch.no_grad():
-            for x, y in test_loader:
-                x, y = x.to(self.device), y.to(self.device)
-                y_pred = self(x)
-                loss += self.loss_function(y_pred, y).item()
-                _, predicted = torch.max(y_pred.data, 1)
-                total += y.size(0)
-                correct += (predicted == y).sum().item()
-        accuracy = correct / total
-        return loss / total, accuracy
\ No newline at end of file
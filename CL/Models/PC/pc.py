@@ -85,7 +85,9 @@ class pc_cnn(object):
         # and send it to the current device
         X,Y=next(TrainingIterator)
         X=X.to(device)
-        Y=ToOneHot(Y,10).to(device)
+        if Y.dim() == 1: # labels may already come one-hot encoded from the dataset
+          Y=ToOneHot(Y,10)
+        Y=Y.to(device)
 
         _,Loss,_,_,_ = PCInfer(self.layers, loss_fcn, X, Y, "Strict" , eta, n)
 
@@ -124,7 +126,9 @@ class pc_cnn(object):
           TestingIterator=iter(test_loader)
           Xtest,Ytest=next(TestingIterator)
           Xtest=Xtest.to(device)
-          Ytest=ToOneHot(Ytest,10).to(device)
+          if Ytest.dim() == 1:
+            Ytest=ToOneHot(Ytest,10)
+          Ytest=Ytest.to(device)
           YhatTest=self.layers(Xtest)
           self.test_losses[jj] = loss_fcn(YhatTest,Ytest).item()
           self.test_accs[jj]=(torch.sum(torch.argmax(Ytest,axis=1)==torch.argmax(YhatTest,axis=1))/batch_size).item()
@@ -5,6 +5,7 @@ import torch.nn.functional as F
 from copy import deepcopy
 import math
 from utils import *
+from checkpoint import writer, save_numpy
 
 class ConvLayer(object):
   def __init__(self,input_size,num_channels,num_filters,batch_size,kernel_size,learning_rate,f,df,padding=0,stride=1,device="cpu"):
@@ -28,13 +29,14 @@ class ConvLayer(object):
     self.X_col = self.unfold(inp.clone())
     self.flat_weights = self.kernel.reshape(self.num_filters,-1)
     out = self.flat_weights @ self.X_col
-    self.activations = out.reshape(self.batch_size, self.num_filters, self.output_size, self.output_size)
+    # the batch dimension follows the input, so that evaluation can use larger batches than training
+    self.activations = out.reshape(len(inp), self.num_filters, self.output_size, self.output_size)
     return self.f(self.activations)
 
   def update_weights(self,e,update_weights=False,sign_reverse=False):
     fn_deriv = self.df(self.activations)
     e = e * fn_deriv
-    self.dout = e.reshape(self.batch_size,self.num_filters,-1)
+    self.dout = e.reshape(len(e),self.num_filters,-1)
     dW = self.dout @ self.X_col.permute(0,2,1)
     dW = torch.sum(dW,dim=0)
     dW = dW.reshape((self.num_filters,self.num_channels,self.kernel_size,self.kernel_size))
@@ -48,7 +50,7 @@ class ConvLayer(object):
   def backward(self,e):
     fn_deriv = self.df(self.activations)
     e = e * fn_deriv
-    self.dout = e.reshape(self.batch_size,self.num_filters,-1)
+    self.dout = e.reshape(len(e),self.num_filters,-1)
     dX_col = self.flat_weights.T @ self.dout
     dX = self.fold(dX_col)
     return torch.clamp(dX,-50,50)
@@ -60,7 +62,7 @@ class ConvLayer(object):
     self.kernel = nn.Parameter(self.kernel)
 
   def save_layer(self,logdir,i):
-      np.save(logdir +"/layer_"+str(i)+"_weights.npy",self.kernel.detach().cpu().numpy())
+      writer.save(self.kernel.detach().cpu().numpy(), logdir +"/layer_"+str(i)+"_weights.npy", save_numpy)
 
   def load_layer(self,logdir,i):
     kernel = np.load(logdir +"/layer_"+str(i)+"_weights.npy")
@@ -121,7 +123,8 @@ class AvgPool(object):
 class ProjectionLayer(object):
   def __init__(self,input_size, output_size,f,df,learning_rate,device='cpu'):
     self.input_size = input_size
-    self.B, self.C, self.H, self.W = self.input_size
+    # (C, H, W), a leading batch dimension is accepted and ignored
+    self.C, self.H, self.W = self.input_size[-3:]
     self.output_size =output_size
     self.learning_rate = learning_rate
     self.f = f
@@ -160,7 +163,7 @@ class ProjectionLayer(object):
     self.weights = nn.Parameter(self.weights)
 
   def save_layer(self,logdir,i):
-    np.save(logdir +"/layer_"+str(i)+"_weights.npy",self.weights.detach().cpu().numpy())
+    writer.save(self.weights.detach().cpu().numpy(), logdir +"/layer_"+str(i)+"_weights.npy", save_numpy)
 
   def load_layer(self,logdir,i):
     weights = np.load(logdir +"/layer_"+str(i)+"_weights.npy")
@@ -206,7 +209,7 @@ class FCLayer(object):
     self.weights = nn.Parameter(self.weights)
 
   def save_layer(self,logdir,i):
-    np.save(logdir +"/layer_"+str(i)+"_weights.npy",self.weights.detach().cpu().numpy())
+    writer.save(self.weights.detach().cpu().numpy(), logdir +"/layer_"+str(i)+"_weights.npy", save_numpy)
 
   def load_layer(self,logdir,i):
     weights = np.load(logdir +"/layer_"+str(i)+"_weights.npy")
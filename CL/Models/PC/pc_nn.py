@@ -10,8 +10,9 @@ import math
 import os
 import time
 # import matplotlib.pyplot as plt
-import subprocess
 from utils import *
+from checkpoint import writer, save_numpy
+from evaluate import evaluate
 
 
 
@@ -94,12 +95,9 @@ class pc_net(object):
       return L,acc,weight_diffs
 
   def test_accuracy(self,testset):
-    accs = []
-    for i,(inp, label) in enumerate(testset):
-        pred_y = self.no_grad_forward(inp.to(DEVICE))
-        acc =accuracy(pred_y,onehot(label, 10).to(DEVICE))
-        accs.append(acc)
-    return np.mean(np.array(accs)),accs
+    # the last layer outputs softmax probabilities, labels may come as indices or one-hot
+    metrics = evaluate(self.no_grad_forward, testset, probabilities=True, device=DEVICE)
+    return metrics.accuracy, metrics
 
   def train(self,dataset,testset,n_epochs,n_inference_steps,logdir,savedir, old_savedir,save_every=1,print_every=10, log=False):
     if old_savedir != "None":
@@ -112,14 +110,16 @@ class pc_net(object):
       losslist = []
       print("Epoch: ", epoch)
       for i,(inp, label) in enumerate(dataset):
-        if self.loss_fn != cross_entropy_loss:
+        if self.loss_fn == cross_entropy_loss:
+          label = label.long().to(DEVICE)
+        elif label.dim() == 1: # labels may already come one-hot encoded from the dataset
           label = onehot(label, 10).to(DEVICE)
         else:
-          label = label.long().to(DEVICE)
+          label = label.to(DEVICE)
           
         L, acc,weight_diffs = self.infer(inp.to(DEVICE),label)
         losslist.append(L)
-        mean_acc, acclist = self.test_accuracy(dataset)
+        mean_acc, _ = self.test_accuracy(dataset)
         accs.append(mean_acc)
         mean_loss = np.mean(np.array(losslist))
         losses.append(mean_loss)
@@ -131,18 +131,32 @@ class pc_net(object):
       self.save_model(logdir,savedir,losses,accs,weight_diffs_list,test_accs)
 
   def save_model(self,savedir,logdir,losses,accs,weight_diffs_list,test_accs):
-      for i,l in enumerate(self.layers):
-          l.save_layer(logdir,i)
-      np.save(logdir +"/losses.npy",np.array(losses))
-      np.save(logdir+"/accs.npy",np.array(accs))
-      np.save(logdir+"/weight_diffs.npy",np.array(weight_diffs_list))
-      np.save(logdir+"/test_accs.npy",np.array(test_accs))
-      subprocess.call(['rsync','--archive','--update','--compress','--progress',str(logdir) +"/",str(savedir)])
-      print("Rsynced files from: " + str(logdir) + "/ " + " to" + str(savedir))
+      # written in the background, to logdir and a copy in savedir (formerly rsynced)
+      for directory in (logdir, savedir):
+          for i,l in enumerate(self.layers):
+              l.save_layer(directory,i)
+          writer.save(np.array(losses), directory + "/losses.npy", save_numpy)
+          writer.save(np.array(accs), directory + "/accs.npy", save_numpy)
+          writer.save(np.array(weight_diffs_list), directory + "/weight_diffs.npy", save_numpy)
+          writer.save(np.array(test_accs), directory + "/test_accs.npy", save_numpy)
+      print("Saving files to: " + str(logdir) + " and " + str(savedir))
     #   now = datetime.now()
     #   current_time = str(now.strftime("%H:%M:%S"))
     #   subprocess.call(['echo','saved at time: ' + str(current_time)])
 
+  def checkpoint(self):
+      # the weights of every layer (None for the pooling layers), as saved by save_layer
+      return [getattr(l, "kernel", getattr(l, "weights", None)) for l in self.layers]
+
+  def load_checkpoint(self, weights):
+      for l, w in zip(self.layers, weights):
+          if w is None:
+              continue
+          if hasattr(l, "kernel"):
+              l.kernel = set_tensor(w)
+          else:
+              l.weights = set_tensor(w)
+
   def load_model(self,old_savedir):
       for (i,l) in enumerate(self.layers):
           l.load_layer(old_savedir,i)
@@ -6,6 +6,7 @@ Code used for the experiments conducted in the submitted paper
 '''
 
 from utils import calc_accuracy, calc_angle, calc_accuracy_combined
+from evaluate import evaluate
 
 import torch
 from torch import nn
@@ -20,18 +21,45 @@ class net(metaclass=ABCMeta):
     def predict(self, x):
         return self.forward(x, update=False)
 
-    def test(self, data_loader):
-        pred, label = None, None
-        for x, y in data_loader:
-            x, y = x.to(self.device), y.to(self.device)
-            y_pred = self.predict(x)
-            pred = y_pred if pred is None else torch.concat([pred, y_pred])
-            label = y if label is None else torch.concat([label, y])
+    def test(self, data_loader, return_predictions=False):
+        """
+        Loss and accuracy in a single streaming pass, the predictions are only
+        kept (in preallocated buffers) if return_predictions is set.
 
+        Returns:
+            Loss per sample and accuracy (None for regression), followed by the
+            predictions and labels of every sample if return_predictions is set
+        """
         if isinstance(self.loss_function, nn.CrossEntropyLoss):  # classification
-            return self.loss_function(pred, label) / len(data_loader.dataset), calc_accuracy(pred, label)
-        elif isinstance(self.loss_function, nn.MSELoss):  # regression
-            return self.loss_function(pred, label) / len(data_loader.dataset), None
+            metrics = evaluate(self.predict, data_loader, self.loss_function, device=self.device, keep_outputs=return_predictions)
+            accuracy = metrics.accuracy
+        elif isinstance(self.loss_function, nn.MSELoss):  # regression, only the loss
+            return self._test_regression(data_loader, return_predictions)
         else:
-            return self.loss_function(pred, label) / len(data_loader.dataset), calc_accuracy_combined(pred, label,
-                                                                                                      data_loader.dataset.num_classes)
+            metrics = evaluate(self.predict, data_loader, self.loss_function, num_classes=data_loader.dataset.num_classes,
+                               device=self.device, keep_outputs=return_predictions)
+            accuracy = metrics.accuracy
+        if return_predictions:
+            return metrics.loss, accuracy, metrics.outputs, metrics.targets
+        return metrics.loss, accuracy
+
+    @torch.no_grad()
+    def _test_regression(self, data_loader, return_predictions=False):
+        # the loss is summed on the device and copied to the host once, like evaluate() does
+        loss = torch.zeros((), dtype=torch.float64, device=self.device)
+        outputs, targets, seen = None, None, 0
+        for x, y in data_loader:
+            x, y = x.to(self.device), y.to(self.device)
+            y_pred = self.predict(x)
+            loss += self.loss_function(y_pred, y).to(loss.dtype)
+            if return_predictions:
+                if outputs is None:
+                    outputs = y_pred.new_empty((len(data_loader.dataset),) + y_pred.shape[1:])
+                    targets = y.new_empty((len(data_loader.dataset),) + y.shape[1:])
+                outputs[seen:seen + len(y)] = y_pred
+                targets[seen:seen + len(y)] = y
+            seen += len(y)
+        loss = loss.item() / seen
+        if return_predictions:
+            return loss, None, outputs[:seen], targets[:seen]
+        return loss, None
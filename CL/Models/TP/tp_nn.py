@@ -11,6 +11,9 @@ from Models.TP.tp_layers import tp_layer
 from Models.TP.net import net
 from Models.TP.tp_fcns import parameterized_function
 from utils import calc_angle
+from results import record_dynamics
+from checkpoint import writer
+from evaluate import RunningMetrics
 from copy import deepcopy
 
 import sys
@@ -53,7 +56,7 @@ class tp_net(net):
         return y
 
     def train(self, train_loader, valid_loader, epochs, lr, lrb, std, stepsize, log, save, hyperparams=None,
-              trial = 0, new_ckpt = '', train_ckpts = ''):
+              trial = 0, new_ckpt = '', train_ckpts = '', train_metrics = 'exact'):
         
         train_losses = []
         train_accuracies = []
@@ -73,15 +76,22 @@ class tp_net(net):
             print(f"Epoch: {e}")
             torch.cuda.empty_cache()
             start_time = time.time()
+            # 'online': train metrics from the outputs of the training steps, 'exact': a pass after the epoch
+            running = None
             if e > 0:
+                if train_metrics == 'online':
+                    combined = not isinstance(self.loss_function, (nn.CrossEntropyLoss, nn.MSELoss))
+                    running = RunningMetrics(train_loader.dataset.num_classes if combined else None)
                 for x, y in train_loader:
                     x, y = x.to(self.device), y.to(self.device)
                     # Train feedback weights
                     for i in range(hyperparams["epochs_backward"]):
                         self.train_back_weights(x, y, lrb, std, loss_type=hyperparams["loss_feedback"])
                     # Train forward weights
-                    self.compute_target(x, y, stepsize)
+                    y_pred, loss = self.compute_target(x, y, stepsize)
                     self.update_weights(x, lr)
+                    if running is not None:
+                        running.update(y_pred, y, loss)
             end_time = time.time()
 
             # Compute Positive semi-definiteness (the strict condition) and Trace (the weak condition)
@@ -104,14 +114,18 @@ class tp_net(net):
                 eigenvalues_trace[d] /= len(valid_loader)
 
             # Predict
-            with torch.no_grad():
+            if running is not None:
+                train_loss, train_acc = running.result()
+                if isinstance(self.loss_function, nn.MSELoss):  # regression
+                    train_acc = None
+            else:
                 train_loss, train_acc = self.test(train_loader)
-                valid_loss, valid_acc = self.test(valid_loader)
+            valid_loss, valid_acc = self.test(valid_loader)
 
 
-            train_losses.append(train_loss.item())
+            train_losses.append(train_loss)
             train_accuracies.append(train_acc)
-            test_losses.append(valid_loss.item())
+            test_losses.append(valid_loss)
             test_accuracies.append(valid_acc)
             eps.append(e)
 
@@ -176,6 +190,7 @@ class tp_net(net):
                 plane = self.layers[d + 1].backward_function_1.forward(self.layers[d + 1].target)
                 diff = self.layers[d + 1].backward_function_2.forward(plane, self.layers[d].output)
                 self.layers[d].target = diff
+        return y_pred, loss
 
     def update_weights(self, x, lr):
         self.forward(x)
@@ -199,6 +214,10 @@ class tp_net(net):
     def save_model(self, ckpt):
         path = ckpt
         os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Save the collected parameters to the specified path
+        writer.save(self.checkpoint(), path)
+
+    def checkpoint(self):
         # Collect the parameters from each layer's functions
         layer_params = {}
         for idx, layer in enumerate(self.layers):
@@ -208,39 +227,17 @@ class tp_net(net):
                 'backward_function_1': layer.backward_function_1.get_params(),
                 'backward_function_2': layer.backward_function_2.get_params(),
             }
-        # Save the collected parameters to the specified path
-        torch.save(layer_params, path)
+        return layer_params
 
 
 
     def save_training_dynamics(self, train_losses, train_accuracies, test_losses, test_accuracies, trial, ckpt):
-        path = ckpt
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-
-        # Check if the file exists and has content
-        if os.path.exists(path) and os.path.getsize(path) > 0:
-            with open(path, "r") as file:
-                data = json.load(file)
-        else:
-            # Initialize the dictionary with lists to store results
-            data = [{
-                "Trial": [],
-                "Train Losses": [],
-                "Train Accuracies": [],
-                "Test Losses": [],
-                "Test Accuracies": []
-            }]
-
-        # Append new results to each list within the first dictionary entry
-        data[0]["Trial"].append(trial)
-        data[0]["Train Losses"].append(train_losses)
-        data[0]["Train Accuracies"].append(train_accuracies)
-        data[0]["Test Losses"].append(test_losses)
-        data[0]["Test Accuracies"].append(test_accuracies)
-
-        # Write the updated dictionary back to the file
-        with open(path, "w") as file:
-            json.dump(data, file, indent=4)
+        record_dynamics(ckpt, trial, {
+            "train_loss": train_losses,
+            "train_accuracy": train_accuracies,
+            "test_loss": test_losses,
+            "test_accuracy": test_accuracies
+        })
 
 
 
@@ -0,0 +1,141 @@
+'''
+
+Streaming summary of the results store.
+
+Reads every checkpoints/<model>/TRAIN-*.jsonl and CL-*.jsonl file record
+by record and keeps, per (model, task prefix, epoch, metric), a running mean and
+variance (Welford) and a Poisson bootstrap of the mean. Memory is constant
+in the number of trials, and the summary table is written as csv:
+
+    python aggregate.py [--root checkpoints] [--out checkpoints/summary.csv]
+
+'''
+
+import os
+import csv
+import glob
+import argparse
+
+import numpy as np
+
+from results import read_results
+
+
+_KEYS = ("model", "tasks", "trial", "epoch")
+
+
+class RunningStat:
+    """
+    Running mean, variance and bootstrap confidence interval of a stream of values.
+
+    The bootstrap is the online (Poisson) variant: every value enters each of
+    the resamples with a Poisson(1) weight, which converges to resampling
+    with replacement without keeping the values.
+
+    Args:
+        resamples: Number of bootstrap resamples
+        rng: numpy Generator drawing the weights
+    """
+    def __init__(self, resamples, rng):
+        self.rng = rng
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.boot_sum = np.zeros(resamples)
+        self.boot_weight = np.zeros(resamples)
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+        weight = self.rng.poisson(1., len(self.boot_sum))
+        self.boot_sum += weight * x
+        self.boot_weight += weight
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.
+
+    def interval(self, level=0.95):
+        """
+        Returns:
+            Percentile bootstrap interval (low, high) of the mean
+        """
+        drawn = self.boot_weight > 0
+        if not drawn.any():
+            return self.mean, self.mean
+        means = self.boot_sum[drawn] / self.boot_weight[drawn]
+        alpha = (1. - level) / 2.
+        low, high = np.quantile(means, [alpha, 1. - alpha])
+        return float(low), float(high)
+
+
+def aggregate(paths, resamples=200, seed=0):
+    """
+    Args:
+        paths: TRAIN and CL jsonl files
+        resamples: Bootstrap resamples per statistic
+        seed: Seed of the bootstrap weights
+
+    Returns:
+        Dict from (model, tasks, epoch, metric) to its RunningStat
+    """
+    rng = np.random.default_rng(seed)
+    stats = {}
+    for path in paths:
+        for record in read_results(path):
+            for metric, value in record.items():
+                if metric in _KEYS or not isinstance(value, (int, float)):
+                    continue
+                # CL records (see continual.py) summarize a whole sequence, epoch -1
+                key = (record["model"], record["tasks"], record.get("epoch", -1), metric)
+                if key not in stats:
+                    stats[key] = RunningStat(resamples, rng)
+                stats[key].add(float(value))
+    return stats
+
+
+def summary(stats, level=0.95):
+    """
+    Returns:
+        Rows of the summary table, sorted by model, task prefix, metric and epoch
+    """
+    rows = []
+    for (model, tasks, epoch, metric), stat in stats.items():
+        low, high = stat.interval(level)
+        rows.append({
+            "model": model, "tasks": tasks, "epoch": epoch, "metric": metric, "trials": stat.n,
+            "mean": stat.mean, "std": stat.variance ** 0.5, "ci_low": low, "ci_high": high,
+        })
+    rows.sort(key=lambda row: (row["model"], len(row["tasks"]), row["tasks"], row["metric"], row["epoch"]))
+    return rows
+
+
+def write_summary(rows, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", newline="") as file:
+        table = csv.DictWriter(file, fieldnames=list(rows[0]) if rows else [])
+        table.writeheader()
+        table.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default="checkpoints", help="checkpoint directory holding <model>/TRAIN-*.jsonl")
+    parser.add_argument("--out", default=None, help="summary csv, <root>/summary.csv by default")
+    parser.add_argument("--resamples", type=int, default=200, help="bootstrap resamples")
+    parser.add_argument("--level", type=float, default=0.95, help="confidence level of the intervals")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.root, "*", "TRAIN-*.jsonl")) + glob.glob(os.path.join(args.root, "*", "CL-*.jsonl")))
+    rows = summary(aggregate(paths, args.resamples), args.level)
+    out = args.out or os.path.join(args.root, "summary.csv")
+    write_summary(rows, out)
+
+    for row in rows:
+        if row["metric"] in ("test_accuracy", "acc", "bwt"):
+            print(f"{row['model']:6s} {row['tasks']:20s} {row['metric']:13s} epoch {row['epoch']:3d}  "
+                  f"{row['mean']:.4f} +- {row['std']:.4f}  [{row['ci_low']:.4f}, {row['ci_high']:.4f}]  (n={row['trials']})")
+    print(f"Summary of {len(rows)} statistics from {len(paths)} files written to {out}")
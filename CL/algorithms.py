@@ -0,0 +1,322 @@
+'''
+
+Registry of the training algorithms.
+
+Every algorithm registers a lightweight class with its default config,
+how its data is loaded and how it builds, loads and trains its model. The
+model modules are only imported when a model is built, so a worker only
+imports the stack of the algorithm it trains.
+
+'''
+
+import os
+
+from checkpoint import _snapshot
+
+
+# shared by every algorithm, overridden by the algorithm defaults and then by the experiment spec
+DEFAULTS = {
+    "epochs": 5,
+    "batch_size": 64,
+    "eval_batch_size": 4096, # evaluation batches, independent of the training batch size
+    "test": True,
+    "lr": 0.1,
+    "hid_dim": 256,
+    "depth": 6,
+    # "exact": train loss and accuracy from a pass over the training set after every epoch,
+    # "online": from the outputs of the training steps (BP, TP and KAN), which saves that pass
+    "train_metrics": "exact",
+}
+
+ALGORITHMS = {}
+
+
+def register(*names):
+    """
+    Class decorator registering an Algorithm under one or more names.
+    """
+    def wrap(cls):
+        for name in names:
+            ALGORITHMS[name] = cls
+        return cls
+    return wrap
+
+
+def get(name, config=None):
+    """
+    Args:
+        name: Registered algorithm, e.g. "BP"
+        config: Overrides of its default config
+
+    Returns:
+        The Algorithm instance
+    """
+    if name not in ALGORITHMS:
+        raise ValueError(f"Unkown algorithm \"{name}\". Please choose from {', '.join(ALGORITHMS)}.")
+    return ALGORITHMS[name](name, config)
+
+
+class Algorithm:
+    """
+    Base class of the registered algorithms.
+
+    Args:
+        name: Name the algorithm was registered under
+        config: Overrides of DEFAULTS and the class config
+    """
+    config = {}
+    flavor = "flat" # dataset flavor, see dataset.load_dataset
+    drop_last = False # train on full batches only, replayed samples then replace part of a batch
+    pin_memory = True
+    device = None # device the batches are prefetched to, None for the training device
+    cost = 1. # rough time of one epoch relative to BP, for packing the jobs
+    probabilities = False # the model outputs class probabilities rather than logits
+
+    def __init__(self, name, config=None):
+        self.name = name
+        self.config = {**DEFAULTS, **type(self).config, **(config or {})}
+
+    @property
+    def label(self):
+        return self.name
+
+    def params(self):
+        # configuration logged to wandb
+        return {"name": self.label}
+
+    def estimate(self, tasks):
+        """
+        Estimated cost of a (model, trial) job training the given number of tasks.
+        """
+        return self.cost * self.config["epochs"] * tasks
+
+    def build(self, in_dim, out_dim, larger, device):
+        raise NotImplementedError
+
+    def predictor(self, model):
+        # function from a batch of inputs to the outputs of the model, for evaluation
+        model.eval()
+        return model
+
+    def load(self, model, path):
+        model.load_state(path, self.config["lr"])
+
+    def snapshot(self, model):
+        # in-memory copy of the trained state, the earlier branches of a fork start from it
+        return _snapshot(model.checkpoint())
+
+    def restore(self, model, state):
+        model.load_checkpoint(state, self.config["lr"])
+
+    def fit(self, model, train_loader, valid_loader, trial, ckpt, train_ckpts, log, save):
+        raise NotImplementedError
+
+
+def _loss_function():
+    from torch import nn
+    return nn.CrossEntropyLoss(reduction="sum")
+
+
+@register("BP")
+class BP(Algorithm):
+
+    def params(self):
+        return {
+            "ff1": {
+                "type": "parameterized",
+                "act": "linear-BN",
+                "init": "orthogonal"
+            },
+            "ff2": {
+                "type": "parameterized",
+                "act": "tanh-BN",
+                "init": "orthogonal"
+            },
+            "name": self.label,
+        }
+
+    def build(self, in_dim, out_dim, larger, device):
+        from Models.BP.bp_nn import bp_net
+        return bp_net(self.config["depth"], in_dim, self.config["hid_dim"], out_dim, _loss_function(), device, params=self.params())
+
+    def fit(self, model, train_loader, valid_loader, trial, ckpt, train_ckpts, log, save):
+        model.train_model(train_loader, valid_loader, self.config["epochs"], self.config["lr"], log, save,
+                          trial=trial, new_ckpt=ckpt, train_ckpts=train_ckpts, train_metrics=self.config["train_metrics"])
+
+
+@register("TP")
+class TP(Algorithm):
+    config = {
+        "direct_depth": 1,
+        "epochs_backward": 5,
+        "lr_backward": 1e-3,
+        "std_backward": 0.01,
+        "stepsize": 0.04,
+        "loss_feedback": "DTP",
+    }
+    cost = 3.
+    bf2 = "identity" # type of the backward function of the last layers
+    last = "linear"
+
+    def bf1_init(self):
+        return "orthogonal"
+
+    def params(self):
+        return {
+            "ff1": {"type": "identity", "init": None, "act": "linear-BN"},
+            "ff2": {"type": "parameterized", "init": "orthogonal", "act": "tanh-BN"},
+            "bf1": {"type": "parameterized", "init": self.bf1_init(), "act": "tanh-BN"},
+            "bf2": {"type": self.bf2, "init": None, "act": "linear-BN"},
+            "last": self.last,
+            "name": self.label,
+        }
+
+    def build(self, in_dim, out_dim, larger, device):
+        from Models.TP.tp_nn import tp_net
+        c = self.config
+        return tp_net(c["depth"], c["direct_depth"], in_dim, c["hid_dim"], out_dim, _loss_function(), device, params=self.params())
+
+    def predictor(self, model):
+        return model.predict
+
+    def load(self, model, path):
+        import torch
+        # the layer functions are saved with numpy arrays
+        model.load_state(torch.load(path, weights_only=False))
+
+    def restore(self, model, state):
+        model.load_state(state)
+
+    def fit(self, model, train_loader, valid_loader, trial, ckpt, train_ckpts, log, save):
+        c = self.config
+        model.train(train_loader, valid_loader, c["epochs"], c["lr"], c["lr_backward"], c["std_backward"], c["stepsize"],
+                    log, save, hyperparams={"loss_feedback": c["loss_feedback"], "epochs_backward": c["epochs_backward"]},
+                    trial=trial, new_ckpt=ckpt, train_ckpts=train_ckpts, train_metrics=c["train_metrics"])
+
+
+@register("DTP")
+class DTP(TP):
+    bf2 = "difference"
+
+    @property
+    def label(self):
+        return self.name + "-eq"
+
+
+@register("FWDTP")
+class FWDTP(TP):
+    config = {**TP.config, "sparse_ratio": 0.5}
+    bf2 = "difference"
+    last = "linear-BN"
+
+    def bf1_init(self):
+        sparse_ratio = self.config["sparse_ratio"]
+        return "orthogonal" + (f"-sparse-{sparse_ratio}" if 0 <= sparse_ratio <= 1 else "")
+
+
+@register("KAN")
+class KAN(Algorithm):
+    config = {"lr": 0.005}
+    flavor = "image"
+    cost = 4.
+
+    def build(self, in_dim, out_dim, larger, device):
+        from Models.KAN.kan_nn import kan_net
+        return kan_net(in_dim, out_dim, _loss_function(), device, larger)
+
+    def fit(self, model, train_loader, valid_loader, trial, ckpt, train_ckpts, log, save):
+        model.train_model(train_loader, valid_loader, self.config["epochs"], self.config["lr"], log, save,
+                          trial=trial, new_ckpt=ckpt, train_ckpts=train_ckpts, train_metrics=self.config["train_metrics"])
+
+
+@register("EP")
+class EP(Algorithm):
+    config = {
+        "lr": 0.005,
+        "cost_energy": "cross_entropy",
+        "dynamics": {"dt": 0.1, "n_relax": 20, "tau": 1, "tol": 0},
+    }
+    flavor = "one-hot"
+    drop_last = True
+    pin_memory = False
+    device = "cpu" # ep_net runs on the cpu
+    cost = 20.
+    probabilities = True
+
+    def params(self):
+        return {"name": self.label, "cost_energy": self.config["cost_energy"], "batch_size": self.config["batch_size"],
+                "tyoe": "cond_gaussian", "dynamics": self.config["dynamics"]}
+
+    def build(self, in_dim, out_dim, larger, device):
+        from Models.EP.ep_nn import ep_net
+        batch_size = self.config["batch_size"]
+        return ep_net(type='cond_gaussian', dimensions=[in_dim, batch_size * out_dim, out_dim],
+                      cost_energy=self.config["cost_energy"], batch_size=batch_size)
+
+    def predictor(self, model):
+        return lambda x: model.predict_batch(x, self.config["dynamics"], fast_init=True)
+
+    def fit(self, model, train_loader, valid_loader, trial, ckpt, train_ckpts, log, save):
+        model.train_model(train_loader, valid_loader, self.config["epochs"], self.config["dynamics"], lr=self.config["lr"],
+                          log=log, save=save, trial=trial, new_ckpt=ckpt, train_ckpts=train_ckpts)
+
+
+@register("PC")
+class PC(Algorithm):
+    config = {
+        "lr": 0.005, # 0.0005 in the paper
+        "num_inference_steps": 100,
+        "inference_lr": 0.01,
+    }
+    flavor = "one-hot"
+    drop_last = True
+    cost = 30.
+    probabilities = True # the last layer is a softmax
+
+    def build(self, in_dim, out_dim, larger, device):
+        import torch.nn.functional as F
+        from utils import parse_loss_function, relu, relu_deriv, linear_deriv
+        from Models.PC.pc_nn import pc_net
+        from Models.PC.pc_layers import ConvLayer, MaxPool, ProjectionLayer, FCLayer
+
+        lr, batch_size = self.config["lr"], self.config["batch_size"]
+        loss_fn, loss_fn_deriv = parse_loss_function("crossentropy")
+        if not larger: # then mnist size
+            # Convolutional layer with 1 input channel, 6 output filters, kernel size 5x5
+            l1 = ConvLayer(input_size=28, num_channels=1, num_filters=6, batch_size=batch_size, kernel_size=5, learning_rate=lr, f=relu, df=relu_deriv, device=device)
+            # Max pooling layer with kernel size 2x2
+            l2 = MaxPool(2, device=device)
+            # Convolutional layer with 6 input channels, 16 output filters, kernel size 5x5
+            l3 = ConvLayer(input_size=12, num_channels=6, num_filters=16, batch_size=batch_size, kernel_size=5, learning_rate=lr, f=relu, df=relu_deriv, device=device)
+            # Projection layer with input size corresponding to the output size of the previous conv layer
+            l4 = ProjectionLayer(input_size=(16, 8, 8), output_size=120, f=relu, df=relu_deriv, learning_rate=lr, device=device)
+            l5 = FCLayer(input_size=120, output_size=84, batch_size=batch_size, learning_rate=lr, f=relu, df=relu_deriv, device=device)
+            # Final fully connected layer with 10 output classes
+            l6 = FCLayer(input_size=84, output_size=out_dim, batch_size=batch_size, learning_rate=lr, f=F.softmax, df=linear_deriv, device=device)
+        else:
+            ## input for cifar 10, so 28x28 --> 32x32x3 to account for rbg
+            l1 = ConvLayer(input_size=32, num_channels=3, num_filters=6, batch_size=batch_size, kernel_size=5, learning_rate=lr, f=relu, df=relu_deriv, device=device)
+            l2 = MaxPool(2, device=device)
+            l3 = ConvLayer(input_size=14, num_channels=6, num_filters=16, batch_size=batch_size, kernel_size=5, learning_rate=lr, f=relu, df=relu_deriv, device=device)
+            l4 = ProjectionLayer(input_size=(16, 10, 10), output_size=200, f=relu, df=relu_deriv, learning_rate=lr, device=device)
+            l5 = FCLayer(input_size=200, output_size=150, batch_size=batch_size, learning_rate=lr, f=relu, df=relu_deriv, device=device)
+            l6 = FCLayer(input_size=150, output_size=out_dim, batch_size=batch_size, learning_rate=lr, f=F.softmax, df=linear_deriv, device=device)
+
+        return pc_net([l1, l2, l3, l4, l5, l6], self.config["num_inference_steps"], self.config["inference_lr"],
+                      loss_fn=loss_fn, loss_fn_deriv=loss_fn_deriv, device=device)
+
+    def predictor(self, model):
+        return model.no_grad_forward
+
+    def load(self, model, path):
+        model.load_model(path)
+
+    def restore(self, model, state):
+        model.load_checkpoint(state)
+
+    def fit(self, model, train_loader, valid_loader, trial, ckpt, train_ckpts, log, save):
+        log_dir = ckpt.replace("/models/", "/logs/")
+        os.makedirs(ckpt, exist_ok=True)
+        os.makedirs(log_dir, exist_ok=True)
+        # "None": the weights of the previous task are already in the model
+        model.train(train_loader, valid_loader, self.config["epochs"], self.config["num_inference_steps"], log_dir, ckpt, "None", log=log)
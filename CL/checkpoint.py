@@ -0,0 +1,162 @@
+'''
+
+Checkpoint naming, pruning and writing for task sequences of any length.
+
+A checkpoint is keyed by the task prefix it was trained on. Short prefixes
+keep their readable name (m-f-m). Longer ones, e.g. 50 permuted MNIST
+tasks, are named by their first and last task, length and a hash of the
+whole prefix.
+
+Checkpoints are written by a background thread (writer) so that training
+continues while they hit the disk.
+
+'''
+
+import os
+import queue
+import atexit
+import shutil
+import hashlib
+import threading
+
+import numpy as np
+import torch
+
+
+_READABLE_TASKS = 6 # prefixes up to this length are named by their tasks
+
+
+def prefix_key(prefix):
+    if len(prefix) <= _READABLE_TASKS:
+        return "-".join(prefix)
+    digest = hashlib.sha1("-".join(prefix).encode()).hexdigest()[:12]
+    return f"{prefix[0]}-{prefix[-1]}-n{len(prefix)}-{digest}"
+
+
+def checkpoint_path(mod, prefix, trial):
+    # pc_net saves into a directory, the other models into a single file
+    extension = "" if mod == "PC" else ".pth"
+    return "checkpoints/" + mod + "/models/" + mod + "-" + prefix_key(prefix) + "-trial" + str(trial) + extension
+
+
+def results_path(mod, prefix):
+    return "checkpoints/" + mod + "/TRAIN-" + mod + "-" + prefix_key(prefix) + ".jsonl"
+
+
+class CheckpointPruner:
+    """
+    Bounds the disk usage of long task sequences.
+
+    The checkpoints of the last keep trained prefixes are kept. So are the
+    checkpoints of prefixes that a branch of the trie still has to fork
+    from, and those at the end of a sequence. All others are deleted.
+
+    Args:
+        trie: PrefixTrie of the sequences being trained
+        keep: Number of recent prefix checkpoints to keep, None keeps every checkpoint
+    """
+    def __init__(self, trie, keep=None):
+        self.trie = trie
+        self.keep = keep
+        self.saved = []
+        self.visited = set()
+
+    def visit(self, prefix, path=None):
+        """
+        Called once a prefix has been trained (with the checkpoint it saved) or skipped.
+        """
+        self.visited.add(prefix)
+        if path is not None:
+            self.saved.append((prefix, path))
+        if self.keep is None:
+            return
+
+        for saved in self.saved[:max(len(self.saved) - self.keep, 0)]:
+            prefix, path = saved
+            children = self.trie.children[prefix]
+            if children and all(child in self.visited for child in children):
+                writer.flush() # the checkpoint may still be queued
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+                self.saved.remove(saved)
+
+
+def _snapshot(obj):
+    # copy every tensor and array, so that training can go on modifying the originals
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    if isinstance(obj, dict):
+        return {key: _snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(value) for value in obj)
+    return obj
+
+
+def save_numpy(array, file):
+    np.save(file, array)
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints in a background thread.
+
+    save() takes a CPU snapshot of the state and queues it. The thread
+    writes it to a temporary file, which is then atomically renamed, so a
+    crash never leaves a truncated checkpoint behind. Files are written in
+    the order they were queued. The queue is bounded, so save() blocks
+    instead of piling up snapshots when the disk is slower than training.
+
+    Args:
+        depth: Maximum number of queued checkpoints
+    """
+    def __init__(self, depth=2):
+        self.queue = queue.Queue(maxsize=depth)
+        self.error = None
+        self.worker = None
+
+    def save(self, obj, path, save=torch.save):
+        """
+        Args:
+            obj: State to save, tensors and arrays in it are copied before returning
+            path: Destination file
+            save: Function writing obj to an open binary file, e.g. torch.save or save_numpy
+        """
+        self._raise()
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self._write, daemon=True)
+            self.worker.start()
+        self.queue.put((_snapshot(obj), path, save))
+
+    def _write(self):
+        while True:
+            obj, path, save = self.queue.get()
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as file:
+                    save(obj, file)
+                os.replace(tmp_path, path)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def flush(self):
+        """
+        Wait until every queued checkpoint is on disk.
+        """
+        self.queue.join()
+        self._raise()
+
+
+writer = CheckpointWriter()
+atexit.register(writer.flush)
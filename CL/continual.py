@@ -0,0 +1,147 @@
+'''
+
+Continual learning evaluation: accuracy on every task seen so far.
+
+After a task prefix has been trained, the model is scored on the test set
+of each of its tasks, which fills a row of the accuracy matrix R, where
+R[i][j] is the accuracy on task j after training task i. From R follow
+
+    ACC = mean_j R[T-1][j]                                 average accuracy
+    BWT = mean_{j<T-1} R[T-1][j] - R[j][j]                 backward transfer
+    FWT = mean_{j>0} R[j-1][j] - b_j                       forward transfer
+    forgetting = mean_{j<T-1} max_{l<T-1} R[l][j] - R[T-1][j]
+
+with b_j the accuracy of the untrained model on task j. The test sets stay
+on the device, preprocessed and split into eval batches, so scoring T tasks
+is T batched sweeps.
+
+The matrix and metrics of every sequence are appended to
+checkpoints/<model>/CL-<model>-<tasks>.jsonl, one record per trial. What
+was measured for a trained prefix is also kept in its manifest entry (see
+manifest.py), so a resumed run still completes the matrix of a sequence
+whose first tasks were trained before the interruption.
+
+'''
+
+from checkpoint import prefix_key
+from evaluate import evaluate
+import results
+
+
+def cl_path(mod, sequence):
+    return "checkpoints/" + mod + "/CL-" + mod + "-" + prefix_key(sequence) + ".jsonl"
+
+
+def transfer_metrics(R, baseline=None):
+    """
+    Args:
+        R: T x T accuracy matrix, the entries above the first upper diagonal are not used
+        baseline: Accuracy of the untrained model per task, None if unknown
+
+    Returns:
+        Dict of ACC, BWT, FWT and forgetting (None where a sequence of one task or a missing baseline leaves them undefined)
+    """
+    T = len(R)
+    mean = lambda values: sum(values) / len(values)
+    metrics = {"acc": mean([R[T - 1][j] for j in range(T)]), "bwt": None, "fwt": None, "forgetting": None}
+    if T > 1:
+        metrics["bwt"] = mean([R[T - 1][j] - R[j][j] for j in range(T - 1)])
+        metrics["forgetting"] = mean([max(R[l][j] for l in range(j, T - 1)) - R[T - 1][j] for j in range(T - 1)])
+        if baseline is not None and all(b is not None for b in baseline[1:]):
+            metrics["fwt"] = mean([R[j - 1][j] - baseline[j] for j in range(1, T)])
+    return metrics
+
+
+class ContinualEvaluator:
+    """
+    Scores a model on the test sets of the tasks of one (model, trial) and
+    assembles the accuracy matrix of every sequence of the trie.
+
+    Args:
+        load: Function from a task code to its test set (a dataset with len() and batch())
+        device: Device the test sets are kept on
+        batch_size: Samples per eval batch
+    """
+    def __init__(self, load, device, batch_size=4096):
+        self.load = load
+        self.device = device
+        self.batch_size = batch_size
+        self.tests = {}
+        self.rows = {} # prefix -> accuracy on each of its tasks after training it
+        self.before = {} # prefix -> accuracy on its last task before training it
+        self.baseline = {} # task -> accuracy of the untrained model
+
+    def _batches(self, task):
+        if task not in self.tests:
+            dataset = self.load(task)
+            x, y = dataset.batch(slice(0, len(dataset)))
+            x, y = x.to(self.device), y.to(self.device)
+            self.tests[task] = list(zip(x.split(self.batch_size), y.split(self.batch_size)))
+        return self.tests[task]
+
+    def score(self, predict, tasks, probabilities=False):
+        """
+        Returns:
+            Accuracy of predict on the test set of each task
+        """
+        return [evaluate(predict, self._batches(task), probabilities=probabilities).accuracy for task in tasks]
+
+    def untrained(self, predict, tasks, probabilities=False):
+        # accuracy of a freshly built model, the reference of the forward transfer
+        for task, accuracy in zip(tasks, self.score(predict, tasks, probabilities)):
+            self.baseline.setdefault(task, accuracy)
+
+    def before_task(self, predict, prefix, probabilities=False):
+        self.before[prefix] = self.score(predict, prefix[-1:], probabilities)[0]
+
+    def after_task(self, predict, prefix, probabilities=False):
+        self.rows[prefix] = self.score(predict, prefix, probabilities)
+        print(f"Accuracy on the tasks so far: {[round(accuracy, 4) for accuracy in self.rows[prefix]]}")
+
+    def state(self, prefix):
+        """
+        Returns:
+            What was measured for a trained prefix, to restore it in a resumed run
+        """
+        return {"row": self.rows.get(prefix), "before": self.before.get(prefix), "baseline": dict(self.baseline)}
+
+    def restore(self, prefix, state):
+        # state of a prefix trained by an earlier run, None if that run did not record one
+        if state is None:
+            return
+        if state["row"] is not None:
+            self.rows[prefix] = state["row"]
+        if state["before"] is not None:
+            self.before[prefix] = state["before"]
+        for task, accuracy in state["baseline"].items():
+            self.baseline.setdefault(task, accuracy)
+
+    def matrix(self, sequence):
+        """
+        Returns:
+            The accuracy matrix of a sequence (None above the first upper diagonal), None if a prefix was not scored
+        """
+        T = len(sequence)
+        R = [[None] * T for _ in range(T)]
+        for i in range(T):
+            prefix = tuple(sequence[:i + 1])
+            if prefix not in self.rows:
+                return None
+            R[i][:i + 1] = self.rows[prefix]
+            if i > 0 and prefix in self.before:
+                R[i - 1][i] = self.before[prefix]
+        return R
+
+    def record(self, mod, trial, sequence):
+        """
+        Append the accuracy matrix and transfer metrics of a trained sequence to its CL file.
+        """
+        R = self.matrix(sequence)
+        if R is None: # part of the sequence was trained by an earlier run that kept no scores
+            return
+        baseline = [self.baseline.get(task) for task in sequence]
+        fwt_known = all(R[j - 1][j] is not None for j in range(1, len(sequence)))
+        metrics = transfer_metrics(R, baseline if fwt_known else None)
+        results.record(cl_path(mod, sequence), {"model": mod, "tasks": "-".join(sequence), "trial": trial,
+                                                **metrics, "R": R, "baseline": baseline})
+        print(f"ACC {metrics['acc']:.4f}, BWT {metrics['bwt']}, FWT {metrics['fwt']}, forgetting {metrics['forgetting']}")
@@ -1,5 +1,10 @@
 
 
+import os
+import queue
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import torch
 import torch.nn.functional as F
@@ -8,220 +13,611 @@ import torchvision.transforms as transforms
 
 
 class MyClassification(torch.utils.data.Dataset):
-    def __init__(self, X, y):
+    """
+    Tensor-backed classification dataset.
+
+    Features may be stored compactly as raw uint8 pixels, in which case
+    mean/std give the normalization of the [0, 1] scaled pixels and every
+    returned sample or batch is converted and normalized on the fly.
+    """
+    def __init__(self, X, y, mean=None, std=None):
         self.X = X
         self.y = y
+        self.mean = mean
+        self.std = std
+        if X.dtype == torch.uint8:
+            mean = torch.tensor(mean, dtype=torch.float32).reshape(-1, 1)
+            std = torch.tensor(std, dtype=torch.float32).reshape(-1, 1)
+            self.scale = 1. / (255. * std)
+            self.shift = -mean / std
 
     def __len__(self):
         return len(self.X)
 
     def __getitem__(self, index):
-        feature = self.X[index]
+        feature = self.normalize(self.X[index].unsqueeze(0))[0]
         label = self.y[index]
         return feature, label
+
+    def normalize(self, x):
+        """
+        Convert a batch of raw uint8 pixels to normalized float32 in one pass.
+        Batches that are already floating point are returned unchanged.
+        """
+        if x.dtype != torch.uint8:
+            return x
+        out = x.to(torch.float32)
+        out.view(len(out), len(self.scale), -1).mul_(self.scale).add_(self.shift)
+        return out
+
+    def batch(self, index, pin_memory=False):
+        """
+        Gather a whole batch at once.
+
+        Args:
+            index: slice of contiguous rows or LongTensor of row indices
+            pin_memory: gather rows into page-locked memory
+
+        Returns:
+            Batch of features and labels
+        """
+        if isinstance(index, slice):
+            return self.normalize(self.X[index]), self.y[index]
+        return self.normalize(_gather(self.X, index, pin_memory)), _gather(self.y, index, pin_memory)
+
+    def pin_memory(self):
+        """
+        Move the features and labels to page-locked memory once, so that
+        contiguous batches are already pinned.
+        """
+        if torch.cuda.is_available() and not self.X.is_pinned():
+            self.X, self.y = self.X.pin_memory(), self.y.pin_memory()
+        return self
     
-def _one_hot_ten(label):
+def _gather(t, index, pin_memory=False):
+    if not pin_memory:
+        return t.index_select(0, index)
+    out = torch.empty((len(index),) + t.shape[1:], dtype=t.dtype, pin_memory=True)
+    return torch.index_select(t, 0, index, out=out)
+
+
+class TensorBatchLoader:
+    """
+    In-memory replacement for torch.utils.data.DataLoader over tensor-backed
+    datasets (e.g. MyClassification). Instead of fetching rows one by one and
+    collating them, every batch is a single index_select of the shuffled
+    indices (one permutation per epoch) or a contiguous slice.
+
+    Attributes:
+        dataset: Dataset exposing len() and batch(index, pin_memory)
+        batch_size: Number of samples per batch
+        shuffle: Draw a new permutation of the samples every epoch
+        drop_last: Drop the last incomplete batch
+        pin_memory: Pre-pin the dataset and gather batches into pinned memory (CUDA only)
+    """
+    def __init__(self, dataset, batch_size=1, shuffle=False, drop_last=False, pin_memory=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        if self.pin_memory:
+            self.dataset.pin_memory()
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return -(-len(self.dataset) // self.batch_size)
+
+    def __iter__(self):
+        n = len(self.dataset)
+        stop = n - n % self.batch_size if self.drop_last else n
+        order = torch.randperm(n) if self.shuffle else None
+        for start in range(0, stop, self.batch_size):
+            end = min(start + self.batch_size, n)
+            if order is None:
+                yield self.dataset.batch(slice(start, end))
+            else:
+                yield self.dataset.batch(order[start:end], pin_memory=self.pin_memory)
+
+
+class PrefetchLoader:
+    """
+    Wraps a loader so that a background thread prepares batch k+1 (gather,
+    normalization, one-hot labels, pinning and the host-to-device copy) while
+    the training step on batch k runs. The data is already in RAM, so a thread
+    is enough; torch releases the GIL inside the tensor ops.
+
+    Batches are handed over through a bounded queue (double buffering with the
+    default depth of 2). Every iteration owns its worker thread, which is
+    stopped and joined when the iteration ends, also on break or exceptions.
+
+    Attributes:
+        loader: Wrapped loader (e.g. TensorBatchLoader)
+        device: Device the batches are moved to
+        depth: Maximum number of prepared batches waiting in the queue
+    """
+    def __init__(self, loader, device='cpu', depth=2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth = depth
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    @property
+    def batch_size(self):
+        return self.loader.batch_size
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _to_device(self, t, stream):
+        if self.device.type != 'cuda':
+            return t.to(self.device)
+        if not t.is_pinned():
+            t = t.pin_memory()
+        with torch.cuda.stream(stream):
+            return t.to(self.device, non_blocking=True)
+
+    def _produce(self, batches, stream, stop):
+        def put(item):
+            # give up once the consumer is gone, so the worker can always be joined
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for batch in self.loader:
+                batch = [self._to_device(t, stream) for t in batch]
+                ready = None
+                if stream is not None:
+                    ready = torch.cuda.Event()
+                    ready.record(stream)
+                if not put((batch, ready)):
+                    return
+        except Exception as e:
+            put((e, None))
+            return
+        put((None, None))
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        worker = threading.Thread(target=self._produce, args=(batches, stream, stop), daemon=True)
+        worker.start()
+        try:
+            while True:
+                batch, ready = batches.get()
+                if batch is None:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                if ready is not None:
+                    current = torch.cuda.current_stream(self.device)
+                    ready.wait(current)
+                    for t in batch:
+                        t.record_stream(current)
+                yield tuple(batch)
+        finally:
+            stop.set()
+            worker.join()
+
+
+_CACHE_DIR = './data/cache'
+_CACHE_VERSION = 1
+
+_SOURCES = {
+    'MNIST': tv.datasets.MNIST,
+    'FashionMNIST': tv.datasets.FashionMNIST,
+    'CIFAR10': tv.datasets.CIFAR10,
+    'CIFAR100': tv.datasets.CIFAR100,
+}
+
+
+def _raw_tensors(name, split):
+    """
+    Load the raw uint8 pixels and labels of a dataset split without running
+    a per-sample transform.
+
+    Returns:
+        Flattened uint8 images [N, C*H*W] (channel-major, as ToTensor) and long labels [N]
+    """
+    if name.startswith('STL10'):
+        # STL10 names carry the target resolution, e.g. 'STL10-32'
+        return _stl10_pixels(split, int(name.rsplit('-', 1)[1]))
+
+    source = _SOURCES[name](root='./data', train=split == 'train', download=True)
+    x = source.data
+    if isinstance(x, np.ndarray):  # CIFAR stores images as N x H x W x C numpy arrays
+        x = torch.from_numpy(x).permute(0, 3, 1, 2)
+    y = torch.as_tensor(source.targets, dtype=torch.long)
+    return x.reshape(len(x), -1), y
+
+
+def _stl10_pixels(split, size, chunk=1000):
+    """
+    Stream an STL10 split from the binary files and resize it to size x size.
+
+    The 3x96x96 images are memory-mapped and resized chunk by chunk with an
+    antialiased bilinear interpolation (rounded back to uint8 like a PIL
+    resize), so only the resized split and one chunk are ever held in memory.
+    This matters for the 100k image 'unlabeled' split (2.7 GB at full size).
+
+    Args:
+        split: 'train' (5k), 'test' (8k) or 'unlabeled' (100k, labels are -1)
+        size: Side length of the resized images
+        chunk: Number of images resized at once
+
+    Returns:
+        Flattened uint8 images [N, 3*size*size] and long labels [N]
+    """
+    stl = tv.datasets.STL10
+    folder = os.path.join('./data', stl.base_folder)
+    x_path = os.path.join(folder, f'{split}_X.bin')
+    if not os.path.exists(x_path):
+        tv.datasets.utils.download_and_extract_archive(stl.url, './data', filename=stl.filename, md5=stl.tgz_md5)
+
+    images = np.memmap(x_path, dtype=np.uint8, mode='r').reshape(-1, 3, 96, 96)
+    if split == 'unlabeled':
+        y = torch.full((len(images),), -1, dtype=torch.long)
+    else:
+        y = torch.from_numpy(np.fromfile(os.path.join(folder, f'{split}_y.bin'), dtype=np.uint8)).long() - 1
+
+    x = torch.empty(len(images), 3 * size * size, dtype=torch.uint8)
+    for start in range(0, len(images), chunk):
+        # the binary files store every channel column-major
+        batch = torch.from_numpy(np.array(images[start:start + chunk])).transpose(2, 3)
+        if size != 96:
+            batch = F.interpolate(batch.float(), size=(size, size), mode='bilinear',
+                                  align_corners=False, antialias=True)
+            batch = batch.round_().clamp_(0, 255).to(torch.uint8)
+        x[start:start + len(batch)] = batch.reshape(len(batch), -1)
+    return x, y
+
+
+def _cached_tensors(name, split, mean, std, compact=False):
     """
-    Helper function to convert to a one hot encoding with 10 classes.
+    Feature and label tensors for one split of a dataset.
+
+    The tensors are built once with a single vectorized op over the raw pixels,
+    saved under ./data/cache and memory-mapped on every later call.
 
     Args:
-        label: target label as single number
+        name: torchvision dataset name (key of _SOURCES) or 'STL10-<size>'
+        split: 'train', 'test' or, for STL10, 'unlabeled'
+        mean, std: normalization applied to pixels scaled to [0, 1], per channel if sequences
+        compact: keep the raw uint8 pixels (4x smaller) and leave the
+            normalization to MyClassification
 
     Returns:
-        One-hot tensor with dimension (*, 10) encoding label
+        Features [N, C*H*W] (float32, or uint8 if compact) and labels [N] (long)
     """
-    return torch.nn.functional.one_hot(torch.tensor(label), num_classes=10)
+    kind = '-uint8' if compact else ''
+    path = os.path.join(_CACHE_DIR, f'{name}-{split}{kind}-v{_CACHE_VERSION}.pt')
+    if os.path.exists(path):
+        cached = torch.load(path, mmap=True, weights_only=True)
+        return cached['x'], cached['y']
+
+    x, y = _raw_tensors(name, split)
+    if not compact:
+        mean = torch.tensor(mean, dtype=torch.float32).reshape(-1, 1)
+        std = torch.tensor(std, dtype=torch.float32).reshape(-1, 1)
+        x = x.float().div_(255.)
+        x.view(len(x), len(mean), -1).sub_(mean).div_(std)
+
+    os.makedirs(_CACHE_DIR, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp' # trial workers may build the same cache concurrently
+    torch.save({'x': x.contiguous(), 'y': y}, tmp_path)
+    os.replace(tmp_path, path)
+    return x, y
+
+
+class TensorStore:
+    """
+    Canonical tensors of one dataset split, decoded once and shared by every
+    model family through zero-copy views.
+
+    Attributes:
+        x: Features [N, C*H*W] (float32, or raw uint8 pixels)
+        y: Integer labels [N]
+        shape: Image shape (C, H, W)
+        mean, std: Normalization of the [0, 1] scaled pixels (applied on the fly if x is uint8)
+        num_classes: Number of classes, None for unlabeled data
+    """
+    def __init__(self, x, y, shape, mean, std, num_classes=None):
+        self.x = x
+        self.y = y
+        self.shape = shape
+        self.mean = mean
+        self.std = std
+        self.num_classes = num_classes
+        self.y_one_hot = None
+
+    def __len__(self):
+        return len(self.x)
+
+    def flat(self):
+        return self.x
+
+    def image(self):
+        return self.x.view(-1, *self.shape)
+
+    def labels(self, one_hot=False):
+        """
+        Integer labels [N], or one-hot labels [N, num_classes] (float32) that are
+        computed once per store and shared by every dataset handed out.
+        """
+        if not one_hot:
+            return self.y
+        if self.y_one_hot is None:
+            self.y_one_hot = F.one_hot(self.y, self.num_classes).float()
+        return self.y_one_hot
 
+    def dataset(self, start=None, stop=None, view='flat', one_hot=False):
+        """
+        Dataset over the rows [start, stop) of the store.
 
+        Args:
+            start, stop: Row range (the whole store by default)
+            view: 'flat' for [N, C*H*W] features, 'image' for [N, C, H, W]
+            one_hot: Return one-hot instead of integer labels
+        """
+        x = self.image() if view == 'image' else self.flat()
+        y = self.labels(one_hot)
+        return MyClassification(x[start:stop], y[start:stop], self.mean, self.std)
 
-def make_MNIST(dim=None, test=False, pc = False, ep = False):
-    transform = transforms.Compose([transforms.ToTensor(),
-                                    transforms.Normalize((0.1307,), (0.3081,))])
 
-    mnist_train = tv.datasets.MNIST(root='./data', train=True, download=True, transform=transform)
-    train_x, train_y = torch.empty([60000, 784]), torch.empty([60000], dtype=torch.long)
-    for i, t in enumerate(list(mnist_train)):
-        train_x[i], train_y[i] = t[0].reshape((-1)), t[1]
+def _load_store(name, split, shape, mean, std, compact=False, num_classes=None):
+    return registry.get(('store', name, split, compact),
+                        lambda: TensorStore(*_cached_tensors(name, split, mean, std, compact), shape, mean, std, num_classes))
 
-    mnist_test = tv.datasets.MNIST(root='./data', train=False, download=True, transform=transform)
-    test_x, test_y = torch.empty([10000, 784]), torch.empty([10000], dtype=torch.long)
-    for i, t in enumerate(list(mnist_test)):
-        test_x[i], test_y[i] = t[0].reshape((-1)), t[1]
+
+def _split(name, shape, mean, std, test, num_valid, num_classes, view='flat', one_hot=False, compact=False):
+    train = _load_store(name, 'train', shape, mean, std, compact, num_classes)
+    held_out = _load_store(name, 'test', shape, mean, std, compact, num_classes)
 
     if test:
-            trainset = MyClassification(train_x, train_y)
-            validset = MyClassification(test_x, test_y)
+        trainset = train.dataset(view=view, one_hot=one_hot)
+        validset = held_out.dataset(view=view, one_hot=one_hot)
     else:
-            trainset = MyClassification(train_x[:55000], train_y[:55000])
-            validset = MyClassification(train_x[55000:], train_y[55000:])
+        trainset = train.dataset(stop=-num_valid, view=view, one_hot=one_hot)
+        validset = train.dataset(start=-num_valid, view=view, one_hot=one_hot)
+
+    testset = held_out.dataset(view=view, one_hot=one_hot)
+    return trainset, validset, testset
+
 
-    testset = MyClassification(test_x, test_y)
 
+# as in the original loaders, the image flavors (KAN, EP, PC) train on the whole train split and are
+# validated on the test split, test only chooses between the two for the flat flavor (BP, TP)
+def make_MNIST(dim=None, test=False, pc = False, ep = False, compact=False):
     if ep:
-            Mnist_train = tv.datasets.MNIST('./data/', train=True, download=True,
-                                 transform=transforms.Compose([
-                                     transforms.ToTensor(),
-                                     transforms.Normalize((0.1307,), (0.3081,)),
-                                 ]),
-                                 target_transform=_one_hot_ten
-                                 )
-
-            Mnist_test = tv.datasets.MNIST('./data/', train=False, download=True,
-                                        transform=transforms.Compose([
-                                            transforms.ToTensor(),
-                                            transforms.Normalize((0.1307,), (0.3081,)),
-                                        ]),
-                                        target_transform=_one_hot_ten
-                                        )
-            return Mnist_train, Mnist_test
+        trainset, validset, _ = _split('MNIST', (1, 28, 28), 0.1307, 0.3081, True, 5000, 10,
+                                       view='image', one_hot=True, compact=compact)
+        return trainset, validset
 
     if pc :
-        return mnist_train, mnist_test
+        trainset, validset, _ = _split('MNIST', (1, 28, 28), 0.1307, 0.3081, True, 5000, 10,
+                                       view='image', compact=compact)
+        return trainset, validset
     else:
-        return trainset, validset, testset
+        return _split('MNIST', (1, 28, 28), 0.1307, 0.3081, test, 5000, 10, compact=compact)
 
 
-def make_FashionMNIST(dim=None, test=False, pc = False, ep = False):
-    transform = transforms.Compose([transforms.ToTensor(),
-                                    transforms.Normalize((0.1307,), (0.3081,))])
+def make_FashionMNIST(dim=None, test=False, pc = False, ep = False, compact=False):
+    if ep:
+        trainset, validset, _ = _split('FashionMNIST', (1, 28, 28), 0.1307, 0.3081, True, 5000, 10,
+                                       view='image', one_hot=True, compact=compact)
+        return trainset, validset
 
-    fashion_train = tv.datasets.FashionMNIST(root='./data', train=True,
-                                             download=True, transform=transform)
-    train_x, train_y = torch.empty([60000, 784]), torch.empty([60000], dtype=torch.long)
-    for i, t in enumerate(list(fashion_train)):
-        train_x[i], train_y[i] = t[0].reshape((-1)), t[1]
+    if pc :
+        trainset, validset, _ = _split('FashionMNIST', (1, 28, 28), 0.1307, 0.3081, True, 5000, 10,
+                                       view='image', compact=compact)
+        return trainset, validset
+    else:
+        return _split('FashionMNIST', (1, 28, 28), 0.1307, 0.3081, test, 5000, 10, compact=compact)
 
-    fashion_test = tv.datasets.FashionMNIST(root='./data', train=False,
-                                            download=True, transform=transform)
-    test_x, test_y = torch.empty([10000, 784]), torch.empty([10000], dtype=torch.long)
-    for i, t in enumerate(list(fashion_test)):
-        test_x[i], test_y[i] = t[0].reshape((-1)), t[1]
 
-    if test:
-            trainset = MyClassification(train_x, train_y)
-            validset = MyClassification(test_x, test_y)
+def make_CIFAR10(dim=None, test=False, pc = False, ep = False, compact=False):
+    if ep:
+        trainset, validset, _ = _split('CIFAR10', (3, 32, 32), 0.1307, 0.3081, True, 5000, 10,
+                                       view='image', one_hot=True, compact=compact)
+        return trainset, validset
+
+    if pc :
+        trainset, validset, _ = _split('CIFAR10', (3, 32, 32), 0.1307, 0.3081, True, 5000, 10,
+                                       view='image', compact=compact)
+        return trainset, validset
     else:
-            trainset = MyClassification(train_x[:55000], train_y[:55000])
-            validset = MyClassification(train_x[55000:], train_y[55000:])
+        return _split('CIFAR10', (3, 32, 32), 0.1307, 0.3081, test, 5000, 10, compact=compact)
+    
 
-    testset = MyClassification(test_x, test_y)
 
+_STL10_MEAN = (0.485, 0.456, 0.406)  # Normalization values for STL-10
+_STL10_STD = (0.229, 0.224, 0.225)
+
+
+def make_STL10(dim=None, test=False, pc=False, ep=False, compact=False):
+    # dim is the side length of the resized images, 32 by default to match CIFAR10
+    size = dim or 32
+    name = f'STL10-{size}'
+    shape = (3, size, size)
     if ep:
-            Fmnist_train = tv.datasets.FashionMNIST('./data/', train=True, download=True,
-                                 transform=transforms.Compose([
-                                     transforms.ToTensor(),
-                                     transforms.Normalize((0.1307,), (0.3081,)),
-                                 ]),
-                                 target_transform=_one_hot_ten
-                                 )
-
-            Fmnist_test = tv.datasets.FashionMNIST('./data/', train=False, download=True,
-                                        transform=transforms.Compose([
-                                            transforms.ToTensor(),
-                                            transforms.Normalize((0.1307,), (0.3081,)),
-                                        ]),
-                                        target_transform=_one_hot_ten
-                                        )
-            return Fmnist_train, Fmnist_test
+        trainset, validset, _ = _split(name, shape, _STL10_MEAN, _STL10_STD, True, 500, 10,
+                                       view='image', one_hot=True, compact=compact)
+        return trainset, validset
 
     if pc :
-        return fashion_train, fashion_test
+        trainset, validset, _ = _split(name, shape, _STL10_MEAN, _STL10_STD, True, 500, 10,
+                                       view='image', compact=compact)
+        return trainset, validset
     else:
-        return trainset, validset, testset
+        return _split(name, shape, _STL10_MEAN, _STL10_STD, test, 500, 10, compact=compact)
 
 
-def make_CIFAR10(dim=None, test=False, pc = False):
-    transform = transforms.Compose([transforms.ToTensor(),
-                                    transforms.Normalize((0.1307,), (0.3081,))])
+def make_STL10_unlabeled(dim=None, view='flat', compact=False):
+    """
+    The 100k unlabeled STL10 images (labels are -1), resized like make_STL10.
+    """
+    size = dim or 32
+    store = _load_store(f'STL10-{size}', 'unlabeled', (3, size, size), _STL10_MEAN, _STL10_STD, compact)
+    return store.dataset(view=view)
 
-    cifar_train = tv.datasets.CIFAR10(root='./data', train=True, download=True, transform=transform)
-    train_x, train_y = torch.empty([50000, 3072]), torch.empty([50000], dtype=torch.long)
-    for i, t in enumerate(list(cifar_train)):
-        train_x[i], train_y[i] = t[0].reshape((-1)), t[1]
 
-    cifar_test = tv.datasets.CIFAR10(root='./data', train=False, download=True, transform=transform)
-    test_x, test_y = torch.empty([10000, 3072]), torch.empty([10000], dtype=torch.long)
-    for i, t in enumerate(list(cifar_test)):
-        test_x[i], test_y[i] = t[0].reshape((-1)), t[1]
 
-    if test:
-            trainset = MyClassification(train_x, train_y)
-            validset = MyClassification(test_x, test_y)
-    else:
-            trainset = MyClassification(train_x[:45000], train_y[:45000])
-            validset = MyClassification(train_x[45000:], train_y[45000:])
 
-    testset = MyClassification(test_x, test_y)
+def make_CIFAR100(dim=None, test=False, pc = False, ep = False, compact=False):
+    if ep:
+        trainset, validset, _ = _split('CIFAR100', (3, 32, 32), 0.1307, 0.3081, True, 5000, 100,
+                                       view='image', one_hot=True, compact=compact)
+        return trainset, validset
 
     if pc :
-        return cifar_train, cifar_test
+        trainset, validset, _ = _split('CIFAR100', (3, 32, 32), 0.1307, 0.3081, True, 5000, 100,
+                                       view='image', compact=compact)
+        return trainset, validset
     else:
-        return trainset, validset, testset
-    
+        return _split('CIFAR100', (3, 32, 32), 0.1307, 0.3081, test, 5000, 100, compact=compact)
 
 
-def make_STL10(dim=None, test=False, pc=False):
-    transform = transforms.Compose([
-        # transforms.Resize((28, 28)),  # Resize images to 28x28 -- matching cifar10
-        transforms.ToTensor(),
-        transforms.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225))  # Normalization values for STL-10
-    ])
+####################################################################################################
+#                                        DATASET REGISTRY                                          #
+####################################################################################################
 
-    stl_train = tv.datasets.STL10(root='./data', split='train', download=True, transform=transform)
-    num_train = len(stl_train)
-    train_x, train_y = torch.empty([num_train, 2352]), torch.empty([num_train], dtype=torch.long)
-    for i, t in enumerate(list(stl_train)):
-        train_x[i], train_y[i] = t[0].reshape((-1)), t[1]
+def _nbytes(obj, seen=None):
+    """
+    Approximate resident size of datasets and stores in bytes.
+    Tensors sharing a storage (e.g. views of one TensorStore) are only counted once.
+    """
+    seen = set() if seen is None else seen
+    if isinstance(obj, (tuple, list)):
+        return sum(_nbytes(o, seen) for o in obj)
+    if isinstance(obj, torch.Tensor):
+        storage = obj.untyped_storage()
+        if storage.data_ptr() in seen:
+            return 0
+        seen.add(storage.data_ptr())
+        return storage.nbytes()
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, MyClassification):
+        return _nbytes(obj.X, seen) + _nbytes(obj.y, seen)
+    if isinstance(obj, TensorStore):
+        return _nbytes(obj.x, seen) + _nbytes(obj.y, seen) + _nbytes(obj.y_one_hot, seen)
+    if hasattr(obj, 'data'):  # torchvision datasets
+        return _nbytes(obj.data, seen) + _nbytes(getattr(obj, 'targets', None), seen)
+    return 0
+
+
+class DatasetRegistry:
+    """
+    Process-wide LRU cache of built datasets so repeated tasks in a sequence
+    (and repeated trials) reuse the already loaded tensors.
 
-    stl_test = tv.datasets.STL10(root='./data', split='test', download=True, transform=transform)
-    num_test = len(stl_test)
-    test_x, test_y = torch.empty([num_test, 2352]), torch.empty([num_test], dtype=torch.long)
-    for i, t in enumerate(list(stl_test)):
-        test_x[i], test_y[i] = t[0].reshape((-1)), t[1]
+    Attributes:
+        max_bytes: Memory cap; least recently used entries are evicted once the
+            cached datasets exceed it. The most recent entry is always kept.
+    """
+    def __init__(self, max_bytes=4 * 2**30):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
 
-    if test:
-            trainset = MyClassification(train_x, train_y)
-            validset = MyClassification(test_x, test_y)
-    else:
-            trainset = MyClassification(train_x[:int(0.9*num_train)], train_y[:int(0.9*num_train)])
-            validset = MyClassification(train_x[int(0.9*num_train):], train_y[int(0.9*num_train):])
+    def __contains__(self, key):
+        return key in self.entries
 
-    testset = MyClassification(test_x, test_y)
+    def __len__(self):
+        return len(self.entries)
 
-    if pc :
-        return stl_train, stl_test
-    else:
-        return trainset, validset, testset
+    def nbytes(self):
+        return _nbytes(list(self.entries.values()))
 
+    def get(self, key, build):
+        """
+        Return the cached value for key, building (and caching) it on a miss.
 
+        Args:
+            key: Hashable cache key
+            build: Zero-argument callable producing the value
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
 
+        value = build()
+        self.entries[key] = value
+        while len(self.entries) > 1 and self.nbytes() > self.max_bytes:
+            self.entries.popitem(last=False)
+        return value
 
-def make_CIFAR100(dim=None, test=False, pc = False):
-    transform = transforms.Compose([transforms.ToTensor(),
-                                    transforms.Normalize((0.1307,), (0.3081,))])
+    def clear(self):
+        self.entries.clear()
 
-    cifar_train = tv.datasets.CIFAR100(root='./data', train=True,
-                                       download=True, transform=transform)
-    train_x, train_y = torch.empty([50000, 3072]), torch.empty([50000], dtype=torch.long)
-    for i, t in enumerate(list(cifar_train)):
-        train_x[i], train_y[i] = t[0].reshape((-1)), t[1]
 
-    cifar_test = tv.datasets.CIFAR100(root='./data', train=False,
-                                      download=True, transform=transform)
-    test_x, test_y = torch.empty([10000, 3072]), torch.empty([10000], dtype=torch.long)
-    for i, t in enumerate(list(cifar_test)):
-        test_x[i], test_y[i] = t[0].reshape((-1)), t[1]
+registry = DatasetRegistry()
 
-    if test:
-            trainset = MyClassification(train_x, train_y)
-            validset = MyClassification(test_x, test_y)
-    else:
-            trainset = MyClassification(train_x[:45000], train_y[:45000])
-            validset = MyClassification(train_x[45000:], train_y[45000:])
+_BUILDERS = {
+    'm': make_MNIST,
+    'f': make_FashionMNIST,
+    'c': make_CIFAR10,
+    's': make_STL10,
+}
 
-    testset = MyClassification(test_x, test_y)
+_FLAVORS = {
+    'flat': {},
+    'image': {'pc': True},
+    'one-hot': {'ep': True},
+}
 
-    if pc :
-        return cifar_train, cifar_test
-    else:
-        return trainset, validset, testset
+
+# dataset code -> store name, image shape, normalization and number of classes (see the make_* builders)
+_STORES = {
+    'm': ('MNIST', (1, 28, 28), 0.1307, 0.3081, 10),
+    'f': ('FashionMNIST', (1, 28, 28), 0.1307, 0.3081, 10),
+    'c': ('CIFAR10', (3, 32, 32), 0.1307, 0.3081, 10),
+    's': ('STL10-32', (3, 32, 32), _STL10_MEAN, _STL10_STD, 10),
+}
+
+
+def _make_unnormalized(data):
+    # pixels scaled to [0, 1] without normalization, as used by pc_main
+    name, shape, mean, std, num_classes = _STORES[data]
+    train = _load_store(name, 'train', shape, mean, std, True, num_classes)
+    test = _load_store(name, 'test', shape, mean, std, True, num_classes)
+    return (MyClassification(train.image(), train.labels(one_hot=True), 0., 1.),
+            MyClassification(test.image(), test.labels(one_hot=True), 0., 1.))
+
+
+def load_dataset(data, test=False, flavor='flat', compact=False):
+    """
+    Fetch a dataset through the process-wide registry.
+
+    Args:
+        data: Dataset code, one of 'm' (MNIST), 'f' (FashionMNIST), 'c' (CIFAR10), 's' (STL10)
+        test: Validate on the test split instead of a held-out part of the train split (flat flavor only,
+            the others always validate on the test split)
+        flavor: 'flat' for (trainset, validset, testset) of flattened features (BP/TP),
+            'image' for (trainset, validset) of images (KAN), 'one-hot' for
+            (trainset, validset) of images with precomputed one-hot targets (EP/PC) and
+            'image-unnormalized' for (trainset, testset) of images in [0, 1] with
+            one-hot targets (pc_main)
+        compact: Store features as raw uint8 pixels, normalized per batch
+
+    Returns:
+        Tuple of datasets as returned by the corresponding make_* builder. All
+        flavors are views of the same TensorStore per dataset split.
+    """
+    if data not in _BUILDERS:
+        raise ValueError("Unkown dataset. Please choose from MNIST ('m'), FashionMNIST ('f'), CIFAR10 ('c'), STL10 ('s').")
+    if flavor == 'image-unnormalized':
+        return registry.get((data, test, flavor), lambda: _make_unnormalized(data))
+    if flavor not in _FLAVORS:
+        raise ValueError(f"Unkown dataset flavor \"{flavor}\". Please choose from {list(_FLAVORS)} or 'image-unnormalized'.")
+    return registry.get((data, test, flavor, compact),
+                        lambda: _BUILDERS[data](None, test, compact=compact, **_FLAVORS[flavor]))
@@ -0,0 +1,162 @@
+'''
+
+Single pass evaluation shared by the models.
+
+evaluate() runs a model once over a loader under torch.no_grad and
+accumulates, on the device of the model outputs, the summed loss, top-1
+accuracy, the confusion matrix and calibration bins. The accumulators are
+copied to the host once, after the last batch.
+
+RunningMetrics instead accumulates the loss and accuracy of the outputs
+that the training steps compute anyway, which saves the pass over the
+training set after every epoch.
+
+'''
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+class Metrics:
+    """
+    Result of evaluate().
+
+    Attributes:
+        loss: Loss per sample, None without a loss function
+        accuracy: Top-1 accuracy
+        confusion: (num_classes, num_classes) counts, rows are labels and columns predictions
+        bin_count, bin_confidence, bin_accuracy: Per calibration bin (of the top-1 confidence)
+            number of samples, their mean confidence and accuracy
+        outputs, targets: Raw outputs and targets of every sample, only kept on request (keep_outputs)
+    """
+    def __init__(self, loss, confusion, bin_count, bin_confidence, bin_correct):
+        self.total = int(confusion.sum())
+        self.loss = float(loss) / self.total if loss is not None else None
+        self.confusion = confusion
+        self.accuracy = int(confusion.trace()) / self.total
+        self.bin_count = bin_count
+        self.bin_confidence = bin_confidence / bin_count.clip(min=1)
+        self.bin_accuracy = bin_correct / bin_count.clip(min=1)
+        self.outputs = None
+        self.targets = None
+
+    @property
+    def calibration_error(self):
+        # expected calibration error, the bin-weighted gap between confidence and accuracy
+        return float((abs(self.bin_accuracy - self.bin_confidence) * self.bin_count).sum() / self.total)
+
+
+# not inference_mode: its tensors cannot be updated in place or saved for backward outside of it, which
+# breaks model state created during evaluation, and predictors that need autograd enable it themselves
+@torch.no_grad()
+def evaluate(predict, loader, loss_function=None, num_classes=None, bins=15, probabilities=False, device=None,
+             keep_outputs=False):
+    """
+    Args:
+        predict: Function from a batch of inputs to outputs, e.g. the model
+        loader: Loader of (x, y) batches, y as class indices or one-hot targets
+        loss_function: Summed loss of a batch, called as loss_function(outputs, y)
+        num_classes: Number of classes, the first num_classes outputs are the class scores (all outputs by default)
+        bins: Number of calibration bins
+        probabilities: The outputs are already probabilities (otherwise logits, softmax is applied)
+        device: Device the batches are moved to, None leaves them where the loader puts them
+        keep_outputs: Also return the raw outputs and targets, written into buffers preallocated for the whole dataset
+
+    Returns:
+        Metrics
+    """
+    # the plain task data of a training loader with replay (see replay.py), the buffer is left alone
+    loader = getattr(loader, "eval_loader", loader)
+    loss = confusion = bin_count = bin_confidence = bin_correct = None
+    kept_outputs = kept_targets = None
+    seen = 0
+    for x, y in loader:
+        if device is not None:
+            x, y = x.to(device), y.to(device)
+        outputs = predict(x)
+        num_classes = num_classes or outputs.shape[1]
+        scores = outputs[:, :num_classes]
+        labels = y[:, :num_classes].argmax(dim=1) if y.dim() > 1 else y
+        confidence, predicted = (scores if probabilities else F.softmax(scores, dim=1)).max(dim=1)
+        correct = (predicted == labels).to(confidence.dtype)
+        index = (confidence * bins).long().clamp_(0, bins - 1)
+
+        if confusion is None:
+            # accumulators live on the device of the outputs, nothing is synchronized per batch
+            confusion = torch.zeros(num_classes * num_classes, dtype=torch.long, device=scores.device)
+            bin_count = torch.zeros(bins, dtype=torch.long, device=scores.device)
+            bin_confidence = torch.zeros(bins, dtype=confidence.dtype, device=scores.device)
+            bin_correct = torch.zeros(bins, dtype=confidence.dtype, device=scores.device)
+            if loss_function is not None:
+                loss = torch.zeros((), dtype=torch.float64, device=scores.device)
+            if keep_outputs:
+                kept_outputs = outputs.new_empty((len(loader.dataset),) + outputs.shape[1:])
+                kept_targets = y.new_empty((len(loader.dataset),) + y.shape[1:])
+
+        # index_add_ rather than bincount, which syncs with the host on CUDA to size its output
+        ones = torch.ones_like(predicted)
+        confusion.index_add_(0, labels.long() * num_classes + predicted, ones)
+        bin_count.index_add_(0, index, ones)
+        bin_confidence.index_add_(0, index, confidence)
+        bin_correct.index_add_(0, index, correct)
+        if loss_function is not None:
+            loss += loss_function(outputs, y).to(loss.dtype)
+        if keep_outputs:
+            kept_outputs[seen:seen + len(y)] = outputs
+            kept_targets[seen:seen + len(y)] = y
+        seen += len(y)
+
+    if confusion is None:
+        raise ValueError("Cannot evaluate on an empty loader.")
+    # a single copy to the host (counts are exact in float64)
+    parts = [confusion, bin_count, bin_confidence, bin_correct] + ([loss.view(1)] if loss is not None else [])
+    host = torch.cat([part.double() for part in parts]).cpu().numpy()
+    confusion, bin_count, bin_confidence, bin_correct, loss = np.split(host, np.cumsum([num_classes ** 2, bins, bins, bins]))
+    metrics = Metrics(loss[0] if len(loss) else None, confusion.reshape(num_classes, num_classes).astype(int),
+                      bin_count.astype(int), bin_confidence, bin_correct)
+    if keep_outputs: # fewer rows than the dataset if the loader drops the last batch
+        metrics.outputs, metrics.targets = kept_outputs[:seen], kept_targets[:seen]
+    return metrics
+
+
+class RunningMetrics:
+    """
+    Loss and top-1 accuracy of the training batches, accumulated on the device
+    from the outputs of the training steps. The outputs are those before each
+    update, so the result approximates the metrics of the model during the
+    epoch rather than at its end.
+
+    Args:
+        num_classes: Number of classes, the first num_classes outputs are the class scores (all outputs by default)
+    """
+    def __init__(self, num_classes=None):
+        self.num_classes = num_classes
+        self.loss = None
+        self.correct = None
+        self.total = 0
+
+    @torch.no_grad()
+    def update(self, outputs, y, loss):
+        """
+        Args:
+            outputs: Outputs of the training step
+            y: Its targets, as class indices or one-hot
+            loss: Its summed loss
+        """
+        scores = outputs[:, :self.num_classes] if self.num_classes else outputs
+        labels = y[:, :scores.shape[1]].argmax(dim=1) if y.dim() > 1 else y
+        if self.loss is None:
+            self.loss = torch.zeros((), dtype=torch.float64, device=scores.device)
+            self.correct = torch.zeros((), dtype=torch.long, device=scores.device)
+        self.loss += loss.detach().to(self.loss.dtype)
+        self.correct += (scores.argmax(dim=1) == labels).sum()
+        self.total += len(labels)
+
+    def result(self):
+        """
+        Returns:
+            Loss per sample and accuracy
+        """
+        loss, correct = torch.stack([self.loss, self.correct.to(self.loss.dtype)]).tolist()
+        return loss / self.total, correct / self.total
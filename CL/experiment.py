@@ -0,0 +1,90 @@
+'''
+
+Declarative experiment specs.
+
+A spec is a yaml or json file naming the algorithms, task sequences and
+trials of an experiment, e.g.
+
+    trials: 100
+    models: [BP, DTP, EP, KAN, FWDTP]   # or a mapping to per-model overrides, e.g. {BP: {lr: 0.05}, KAN: {}}
+    sequences: [[m, f, m, f, m]]        # sequences sharing a prefix train it once
+    # generated streams (see tasks.py) are given by their generator and its arguments,
+    # e.g. sequences: [{stream: permuted, num_tasks: 10}]
+    config: {epochs: 5, batch_size: 64} # overrides shared by every model
+    replay: {capacity: 0, size: 16}     # optionally task_quota: 500, dtype: uint8
+
+Keys that are left out take the values of DEFAULT_SPEC, and model configs
+the defaults of their algorithm (see algorithms.py).
+
+'''
+
+import json
+
+import algorithms
+from tasks import permuted_stream, rotated_stream, split_stream
+
+
+_STREAMS = {"permuted": permuted_stream, "rotated": rotated_stream, "split": split_stream}
+
+
+DEFAULT_SPEC = {
+    "trials": 100,
+    "models": ["BP", "DTP", "EP", "KAN", "FWDTP"],
+    "sequences": [['m', 'f', 'm', 'f', 'm']],
+    "config": {},
+    # capacity 0 disables replay, task_quota reserves slots per task, a uint8 buffer stores pixels (see replay.py)
+    "replay": {"capacity": 0, "size": 16, "task_quota": None, "dtype": "float32"},
+    "compact": False, # keep datasets as uint8 pixels, normalized per batch
+    "log": False, # for wandb visuals
+    "continual": True, # score every trained prefix on the test sets of all its tasks, see continual.py
+    "save": None, # "yes" or "no", by default checkpoints are saved for sequences of more than one task
+    "larger": None, # 3x32x32 models, by default if a sequence has a CIFAR10 or STL10 task
+}
+
+
+def _sequence(entry):
+    if isinstance(entry, dict):
+        kwargs = dict(entry)
+        stream = kwargs.pop("stream")
+        if stream not in _STREAMS:
+            raise ValueError(f"Unknown task stream \"{stream}\", expected one of {list(_STREAMS)}.")
+        return _STREAMS[stream](**kwargs)
+    return [str(task) for task in entry]
+
+
+def load_spec(path=None):
+    """
+    Args:
+        path: yaml or json spec file, None for DEFAULT_SPEC
+
+    Returns:
+        The complete spec, with "models" mapping every model to its full config
+    """
+    spec = {}
+    if path is not None:
+        with open(path, "r") as file:
+            if path.endswith((".yaml", ".yml")):
+                import yaml # only needed for yaml specs
+                spec = yaml.safe_load(file) or {}
+            else:
+                spec = json.load(file)
+    unknown = set(spec) - set(DEFAULT_SPEC)
+    if unknown:
+        raise ValueError(f"Unknown spec keys {sorted(unknown)}, expected some of {list(DEFAULT_SPEC)}.")
+    spec = {**DEFAULT_SPEC, **spec}
+    spec["replay"] = {**DEFAULT_SPEC["replay"], **spec["replay"]}
+
+    models = spec["models"]
+    if not isinstance(models, dict):
+        models = {mod: {} for mod in models}
+    spec["models"] = {mod: algorithms.get(mod, {**spec["config"], **(overrides or {})}).config
+                      for mod, overrides in models.items()}
+
+    sequences = [_sequence(entry) for entry in spec["sequences"]]
+    spec["sequences"] = sequences
+    tasks = {task for sequence in sequences for task in sequence}
+    if spec["larger"] is None:
+        spec["larger"] = 'c' in tasks or 's' in tasks
+    if spec["save"] is None:
+        spec["save"] = "yes" if max(len(sequence) for sequence in sequences) > 1 else "no"
+    return spec
@@ -0,0 +1,81 @@
+'''
+
+Manifest of finished (model, trial, task prefix) units, used to resume an
+interrupted sweep.
+
+Every unit is one small json file under checkpoints/<model>/manifest/,
+written atomically once the task has been trained and its results have
+been appended (see results.flush). It is queued on the checkpoint writer
+after the checkpoint of the unit, so it never lands before it. Workers on one or several machines never write the same file,
+so no locking is needed.
+
+'''
+
+import os
+import json
+import time
+
+from checkpoint import prefix_key, writer
+
+
+def _save_json(obj, file):
+    file.write(json.dumps(obj, indent=4).encode())
+
+
+class Manifest:
+    """
+    Args:
+        root: Checkpoint directory (the record of model mod is kept in root/mod/manifest)
+    """
+    def __init__(self, root="checkpoints"):
+        self.root = root
+
+    def path(self, mod, trial, prefix):
+        return os.path.join(self.root, mod, "manifest", mod + "-" + prefix_key(prefix) + "-trial" + str(trial) + ".json")
+
+    def get(self, mod, trial, prefix):
+        """
+        Returns:
+            The record of the unit, or None if it is not finished
+        """
+        path = self.path(mod, trial, prefix)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as file:
+            return json.load(file)
+
+    def finished(self, mod, trial, trie):
+        """
+        Prefixes of the trie that need no training: they are finished and either
+        their checkpoint is still on disk, or every task forking from them is
+        finished too (so a pruned checkpoint is not needed).
+        """
+        finished = set()
+        for prefix in reversed(trie.prefixes()): # every prefix after its branches
+            record = self.get(mod, trial, prefix)
+            if record is None:
+                continue
+            if os.path.exists(record["checkpoint"]) or all(child in finished for child in trie.children[prefix]):
+                finished.add(prefix)
+        return finished
+
+    def record(self, mod, trial, prefix, checkpoint, results_path, continual=None):
+        """
+        Mark a unit as finished.
+
+        Args:
+            mod, trial, prefix: Model, trial and list of tasks trained so far
+            checkpoint: Checkpoint saved after the last task of the prefix
+            results_path: TRAIN json file the results of the unit were appended to
+            continual: Test accuracies measured for the unit, see ContinualEvaluator.state
+        """
+        record = {
+            "model": mod,
+            "trial": trial,
+            "prefix": list(prefix),
+            "checkpoint": checkpoint,
+            "results": results_path,
+            "continual": continual,
+            "time": time.time(),
+        }
+        writer.save(record, self.path(mod, trial, prefix), _save_json)
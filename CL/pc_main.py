@@ -7,10 +7,7 @@ Checkpoint tests for accuracy of each model after each epoch of training.
 '''
 
 from utils import *
-
-import torchvision as tv
-import torchvision.transforms as transforms
-from torchvision.datasets import MNIST, FashionMNIST
+from dataset import load_dataset, TensorBatchLoader
 
 from Models.PC.pc import pc_cnn
 
@@ -93,34 +90,12 @@ def main(TRIALS, datasets, epochs, batch_size, lr, log,
         for d, data in enumerate(datasets): 
             if data == "m":
                 print("making MNIST ...")
-                train_dataset = MNIST('./data',
-                    train=True,
-                    transform=transforms.ToTensor(),
-                    download=True)
-
-                test_dataset = MNIST('./data',
-                    train=False,
-                    transform=transforms.ToTensor(),
-                    download=True)
-
             elif data == "f":
                 print("making FashionMNIST ...")
-                train_dataset = FashionMNIST('./data',
-                    train=True,
-                    transform=transforms.ToTensor(),
-                    download=True)
-
-                test_dataset = FashionMNIST('./data',
-                    train=False,
-                    transform=transforms.ToTensor(),
-                    download=True)
+            train_dataset, test_dataset = load_dataset(data, flavor="image-unnormalized")
                 
-            train_loader = torch.utils.data.DataLoader(dataset=train_dataset,
-                                                    batch_size=batch_size,
-                                                    shuffle=True)
-            test_loader = torch.utils.data.DataLoader(dataset=test_dataset,
-                                                    batch_size=batch_size,
-                                                    shuffle=True)
+            train_loader = TensorBatchLoader(train_dataset, batch_size=batch_size, shuffle=True)
+            test_loader = TensorBatchLoader(test_dataset, batch_size=batch_size, shuffle=True)
 
 
             n_inference_steps = batch_size
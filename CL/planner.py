@@ -0,0 +1,74 @@
+'''
+
+Sequence planner: merges task sequences that share a prefix into a trie,
+so that every prefix is trained once per (model, trial).
+
+E.g. the sequences m-f-m and m-f-c train m, m-f, m-f-m and then m-f-c
+from the m-f checkpoint, 4 tasks instead of 6.
+
+'''
+
+from copy import deepcopy
+
+
+class PrefixTrie:
+    """
+    Args:
+        sequences: Lists of task codes, e.g. [['m', 'f', 'm'], ['m', 'f', 'c']]
+    """
+    def __init__(self, sequences):
+        self.sequences = [tuple(sequence) for sequence in sequences]
+        self.children = {(): []}
+        for sequence in self.sequences:
+            for d in range(1, len(sequence) + 1):
+                prefix = sequence[:d]
+                if prefix not in self.children:
+                    self.children[prefix] = []
+                    self.children[prefix[:-1]].append(prefix)
+
+    def __len__(self):
+        # number of unique prefixes, i.e. tasks to train per (model, trial)
+        return len(self.children) - 1
+
+    def prefixes(self):
+        """
+        Returns:
+            Every prefix once, depth first, so that each branch directly follows the prefix it forks from
+        """
+        order = []
+        stack = list(reversed(self.children[()]))
+        while stack:
+            prefix = stack.pop()
+            order.append(prefix)
+            stack.extend(reversed(self.children[prefix]))
+        return order
+
+    def fork(self, states, prefix, copy=True):
+        """
+        State (e.g. model or replay buffer) a branch continues from.
+
+        Args:
+            states: Dict from prefix to the state trained on it
+            prefix: Prefix about to be trained
+            copy: Give the other branches a deep copy, otherwise they get None
+
+        Returns:
+            The state of the parent prefix, None if it is not in states. The last
+            branch of the parent takes it over, the other branches get a copy.
+        """
+        parent = prefix[:-1]
+        if parent not in states:
+            return None
+        if self.children[parent][-1] == prefix:
+            return states.pop(parent)
+        return deepcopy(states[parent]) if copy else None
+
+    def leaves(self):
+        return [prefix for prefix, children in self.children.items() if prefix and not children]
+
+
+def plan(sequences):
+    trie = PrefixTrie(sequences)
+    total = sum(len(sequence) for sequence in trie.sequences)
+    print(f"Planned {len(trie)} tasks per (model, trial) for {len(trie.sequences)} sequences ({total} without prefix sharing)")
+    return trie
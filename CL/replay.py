@@ -0,0 +1,199 @@
+'''
+
+Rehearsal for continual learning baselines
+
+ReplayBuffer keeps a reservoir sample of everything it has been shown in
+preallocated tensors, and ReplayLoader mixes samples from it into every batch
+of a training loader, so the per-batch loops of all model families can use
+rehearsal without any change. Evaluation passes over the training loader
+(see evaluate.py) see the plain task data and leave the buffer alone.
+
+'''
+
+import torch
+
+
+class ReplayBuffer:
+    """
+    Reservoir sampling replay buffer backed by preallocated tensors.
+
+    The storage is allocated on the first insertion with the shape, label dtype
+    and device of that batch. Insertion is O(1) per sample and vectorized over a
+    batch; sampling is a single gather.
+
+    Attributes:
+        capacity: Maximum number of stored samples
+        task_quota: Optional number of slots reserved per task. Every new task
+            gets its own reservoir of that size, otherwise all tasks share one.
+        dtype: Storage dtype of the features. With torch.uint8 the (normalized)
+            features are quantized back to pixels using the normalization of
+            their dataset, which is lossless for image data and 4x smaller than
+            float32.
+    """
+    def __init__(self, capacity, task_quota=None, dtype=torch.float32):
+        self.capacity = capacity
+        self.task_quota = task_quota
+        self.dtype = dtype
+        self.x = None
+        self.y = None
+        self.regions = {}  # task -> [first slot, size of region, number of samples seen]
+        # with torch.uint8: (mean, std) per channel of every dataset offered so far, and the index of that of each slot
+        self.norms = []
+        self.norm_table = None # [number of norms, 2, channels]
+        self.norm = None
+
+    def __len__(self):
+        return sum(min(size, seen) for _, size, seen in self.regions.values())
+
+    def _allocate(self, x, y):
+        self.x = torch.zeros((self.capacity,) + x.shape[1:], dtype=self.dtype, device=x.device)
+        self.y = torch.zeros((self.capacity,) + y.shape[1:], dtype=y.dtype, device=y.device)
+        if self.dtype == torch.uint8:
+            self.norm = torch.zeros(self.capacity, dtype=torch.long, device=x.device)
+
+    def _region(self, task):
+        if self.task_quota is None:
+            task = None
+        if task not in self.regions:
+            size = self.capacity if self.task_quota is None else self.task_quota
+            start = sum(region[1] for region in self.regions.values())
+            if start + size > self.capacity:
+                raise ValueError(f"Replay buffer of capacity {self.capacity} cannot hold another task quota of {size}.")
+            self.regions[task] = [start, size, 0]
+        return self.regions[task]
+
+    def _norm_index(self, mean, std):
+        # scalars for single channel datasets, per channel tuples otherwise (e.g. STL10)
+        norm = (tuple(mean) if isinstance(mean, (tuple, list)) else (mean,),
+                tuple(std) if isinstance(std, (tuple, list)) else (std,))
+        if norm not in self.norms:
+            if self.norms and len(norm[0]) != len(self.norms[0][0]):
+                raise ValueError(f"Replay buffer holds samples of {len(self.norms[0][0])} channels, got {len(norm[0])}.")
+            self.norms.append(norm)
+            self.norm_table = torch.tensor(self.norms, dtype=torch.float32, device=self.x.device)
+        return self.norms.index(norm)
+
+    def _channels(self, norm):
+        # mean and std of one or of every sample, broadcasting over features viewed as [B, channels, pixels],
+        # which covers flat ([B, C*H*W]) and image ([B, C, H, W]) features
+        mean, std = self.norm_table[norm].unsqueeze(-1).unbind(-3)
+        channels = mean.shape[-2]
+        return mean, std, (channels, self.x.shape[1:].numel() // channels)
+
+    def _encode(self, x, norm):
+        if self.dtype != torch.uint8:
+            return x.to(self.dtype)
+        mean, std, shape = self._channels(norm)
+        pixels = x.reshape(len(x), *shape) * std + mean
+        return torch.round(pixels * 255.).clamp_(0, 255).to(torch.uint8).reshape(x.shape)
+
+    def _decode(self, x, norm):
+        if self.dtype != torch.uint8:
+            return x
+        mean, std, shape = self._channels(norm)
+        pixels = x.reshape(len(x), *shape).to(torch.float32).mul_(1. / 255.)
+        return pixels.sub_(mean).div_(std).reshape(x.shape)
+
+    def add(self, x, y, task=None, mean=0., std=1.):
+        """
+        Offer a batch to the reservoir of the given task.
+
+        Args:
+            x: Features [B, ...]
+            y: Labels [B] or one-hot labels [B, C]
+            task: Task identifier, only used with task quotas
+            mean, std: Normalization of the [0, 1] scaled pixels of x, per channel if sequences, only used with torch.uint8
+        """
+        if self.x is None:
+            self._allocate(x, y)
+        if x.shape[1:] != self.x.shape[1:]:
+            raise ValueError(f"Replay buffer holds samples of shape {tuple(self.x.shape[1:])}, got {tuple(x.shape[1:])}.")
+        region = self._region(task)
+        start, size, seen = region
+
+        # sample i of the stream is kept with probability size / (i + 1), at a random slot
+        position = torch.arange(seen, seen + len(x), device=self.x.device)
+        slot = torch.where(position < size, position,
+                           (torch.rand(len(x), device=self.x.device) * (position + 1)).long())
+        keep = slot < size
+        region[2] = seen + len(x)
+        if not keep.any(): # common once the reservoir is full
+            return
+        norm = self._norm_index(mean, std) if self.dtype == torch.uint8 else None
+        if norm is not None:
+            self.norm[start + slot[keep]] = norm
+        self.x[start + slot[keep]] = self._encode(x.to(self.x.device)[keep], norm)
+        self.y[start + slot[keep]] = y.to(self.y.device)[keep].to(self.y.dtype)
+
+    def sample(self, n):
+        """
+        Draw n stored samples uniformly (with replacement).
+        """
+        filled = torch.tensor([min(size, seen) for _, size, seen in self.regions.values()], device=self.x.device)
+        starts = torch.tensor([start for start, _, _ in self.regions.values()], device=self.x.device)
+        ends = filled.cumsum(0)
+        draw = torch.randint(0, int(ends[-1]), (n,), device=self.x.device)
+        region = torch.searchsorted(ends, draw, right=True)
+        slot = starts[region] + draw - (ends[region] - filled[region])
+        norm = self.norm[slot] if self.dtype == torch.uint8 else None
+        return self._decode(self.x[slot], norm), self.y[slot]
+
+
+class ReplayLoader:
+    """
+    Wraps a training loader and mixes replayed samples into every batch of the
+    training steps. The fresh batches are offered to the buffer during the
+    first pass only, so every sample of the task enters the reservoir once
+    however many epochs are trained. Evaluation iterates eval_loader, the
+    wrapped loader without replay.
+
+    Attributes:
+        loader: Wrapped loader
+        buffer: ReplayBuffer
+        replay_size: Number of replayed samples per batch
+        replace: Overwrite the last replay_size samples of the batch instead of
+            appending, for models with a fixed batch size (EP, PC)
+        task: Task identifier passed to the buffer
+    """
+    def __init__(self, loader, buffer, replay_size, replace=False, task=None):
+        self.loader = loader
+        self.buffer = buffer
+        self.replay_size = replay_size
+        self.replace = replace
+        self.task = task
+        self.fed = False
+        # normalization of the task data, for a torch.uint8 buffer
+        dataset = loader.dataset
+        self.mean = dataset.mean if getattr(dataset, "mean", None) is not None else 0.
+        self.std = dataset.std if getattr(dataset, "std", None) is not None else 1.
+
+    @property
+    def eval_loader(self):
+        return self.loader
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    @property
+    def batch_size(self):
+        return self.loader.batch_size
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        feed, self.fed = not self.fed, True
+        for x, y in self.loader:
+            fresh_x, fresh_y = x, y
+            if len(self.buffer) > 0 and self.replay_size > 0:
+                replay_x, replay_y = self.buffer.sample(self.replay_size)
+                replay_x, replay_y = replay_x.to(x.device, x.dtype), replay_y.to(y.device, y.dtype)
+                if self.replace:
+                    n = min(self.replay_size, len(x))
+                    x, y = torch.cat([x[:len(x) - n], replay_x[:n]]), torch.cat([y[:len(y) - n], replay_y[:n]])
+                else:
+                    x, y = torch.cat([x, replay_x]), torch.cat([y, replay_y])
+            if feed:
+                self.buffer.add(fresh_x, fresh_y, self.task, self.mean, self.std)
+            yield x, y
@@ -0,0 +1,96 @@
+'''
+
+Append-only store of the training dynamics of every (model, trial, task)
+run.
+
+Results go to the per-model checkpoints/<model>/TRAIN-<model>-<tasks>.jsonl
+files, one json record per (model, trial, task prefix, epoch):
+
+    {"model": "BP", "tasks": "m-f", "trial": 3, "epoch": 1, "train_loss": ..., "test_accuracy": ...}
+
+Records are buffered per process and appended in batches under an
+exclusive flock, so that trial workers on one or several machines can
+write to the same file. read_results streams them back.
+
+'''
+
+import os
+import json
+import fcntl
+import atexit
+
+
+_BATCH = 256 # records buffered before they are appended
+
+_context = {} # model and task prefix the next results belong to
+_pending = {} # path -> buffered lines
+
+
+def set_task(model, tasks):
+    """
+    Set the model and task prefix that the following results belong to.
+    """
+    _context.update(model=model, tasks="-".join(tasks))
+
+
+def record_dynamics(path, trial, series):
+    """
+    Record the training dynamics of one trial.
+
+    Args:
+        path: TRAIN jsonl file of the model and task sequence
+        trial: Trial number
+        series: Dict from column name (e.g. "test_accuracy") to its per-epoch values
+    """
+    lines = _pending.setdefault(path, [])
+    for epoch in range(max(len(values) for values in series.values())):
+        record = {**_context, "trial": trial, "epoch": epoch}
+        record.update((key, values[epoch]) for key, values in series.items() if epoch < len(values))
+        lines.append(json.dumps(record) + "\n")
+
+    if sum(len(lines) for lines in _pending.values()) >= _BATCH:
+        flush()
+
+
+def record(path, record):
+    """
+    Append a single record, e.g. the accuracy matrix of a sequence (see continual.py).
+    """
+    _pending.setdefault(path, []).append(json.dumps(record) + "\n")
+    if sum(len(lines) for lines in _pending.values()) >= _BATCH:
+        flush()
+
+
+def flush():
+    """
+    Append every buffered record to its file.
+    """
+    for path, lines in list(_pending.items()):
+        if not lines:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as file:
+            # one locked write per batch, readers never see interleaved lines
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.write("".join(lines))
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+        del _pending[path]
+
+
+atexit.register(flush)
+
+
+def read_results(path):
+    """
+    Stream the records of a TRAIN jsonl file.
+
+    A last line that is still being written is skipped.
+    """
+    with open(path, "r") as file:
+        for line in file:
+            if not line.endswith("\n"):
+                break
+            yield json.loads(line)
@@ -0,0 +1,280 @@
+'''
+
+Trial scheduler: fans independent (model, trial) jobs out to a pool of
+worker processes.
+
+The tasks of one trial always run in order inside a single worker, since
+each task starts from the checkpoint of the previous one. Workers append
+their training dynamics to the shared TRAIN files themselves (see
+results.py).
+
+The jobs of an experiment spec (see experiment.py) are ordered by their
+estimated cost, so the longest jobs start first and the pool stays busy
+until the end of the sweep.
+
+Several machines can split one sweep either statically (shard_jobs, e.g.
+--shard 0/4) or dynamically through a WorkQueue manifest on a shared
+filesystem.
+
+'''
+
+import os
+import json
+import time
+import socket
+import threading
+import multiprocessing as mp
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import torch
+
+import algorithms
+
+
+def _init_worker(threads):
+    # one pool of intra-op threads per worker instead of every worker using all cores
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError: # already set by the parent of a forked worker
+        pass
+
+
+def expand(spec, trie):
+    """
+    (model, trial) jobs of an experiment spec.
+
+    Args:
+        spec: Spec as returned by experiment.load_spec
+        trie: PrefixTrie of its sequences
+
+    Returns:
+        The jobs, most expensive first, and a dict from job to its estimated cost
+    """
+    costs = {}
+    for mod, config in spec["models"].items():
+        cost = algorithms.get(mod, config).estimate(len(trie))
+        for trial in range(1, spec["trials"] + 1):
+            costs[(mod, trial)] = cost
+    # longest processing time first, a static shard then takes every n-th job of a balanced order
+    jobs = sorted(costs, key=lambda job: -costs[job])
+    return jobs, costs
+
+
+def shard_jobs(jobs, shard):
+    """
+    Static split of the jobs over machines.
+
+    Args:
+        jobs: List of jobs
+        shard: "i/n", this machine runs every n-th job starting at job i (0 <= i < n)
+    """
+    index, count = (int(part) for part in shard.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard \"{shard}\", expected i/n with 0 <= i < n.")
+    return jobs[index::count]
+
+
+class WorkQueue:
+    """
+    Work queue of jobs in a json manifest on a filesystem shared by several
+    machines (e.g. NFS).
+
+    Every access to the manifest holds a lock file created with O_EXCL,
+    which is atomic on NFS. Claimed jobs carry a heartbeat that a background
+    thread refreshes. A claim whose heartbeat is older than lease seconds
+    (e.g. its machine died) is handed out again.
+
+    Args:
+        path: Manifest file, created with all jobs pending if missing
+        jobs: Jobs to add to the manifest (jobs already in it keep their state)
+        lease: Seconds after which a claim without heartbeat is stale
+    """
+    def __init__(self, path, jobs, lease=600):
+        self.path = path
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.claimed = set()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.lock():
+            manifest = self._read()
+            for job in jobs:
+                manifest.setdefault(self.key(job), {"job": list(job), "state": "pending"})
+            self._write(manifest)
+
+        self.stop = threading.Event()
+        self.heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self.heartbeat.start()
+
+    @staticmethod
+    def key(job):
+        return "-".join(str(part) for part in job)
+
+    @contextmanager
+    def lock(self, stale=60):
+        lock_path = self.path + ".lock"
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    # the manifest is only locked for milliseconds, an old lock file was left by a crash
+                    info = os.stat(lock_path)
+                    if time.time() - info.st_mtime > stale:
+                        self._break(lock_path, info)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.1)
+        try:
+            os.write(fd, self.owner.encode())
+            os.close(fd)
+            yield
+        finally:
+            os.remove(lock_path)
+
+    def _break(self, lock_path, info):
+        """
+        Remove the stale lock file described by info (an os.stat result).
+
+        Several machines may find the same stale lock. It is renamed away first,
+        which is atomic, so only one of them takes it (the others get
+        FileNotFoundError). If the file taken is not the stale one but a lock
+        created since, it is linked back in place.
+        """
+        taken = f"{lock_path}.{self.owner}.stale"
+        os.rename(lock_path, taken)
+        try:
+            if os.stat(taken).st_ino != info.st_ino:
+                os.link(taken, lock_path) # fails if yet another lock was created meanwhile
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(taken)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as file:
+            return json.load(file)
+
+    def _write(self, manifest):
+        tmp_path = f"{self.path}.{self.owner}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def claim(self):
+        """
+        Returns:
+            The next pending (or stale) job, now claimed by this process, or None if there is none
+        """
+        with self.lock():
+            manifest = self._read()
+            now = time.time()
+            for key, unit in manifest.items():
+                if unit["state"] == "pending" or (unit["state"] == "claimed" and now - unit["heartbeat"] > self.lease):
+                    if unit["state"] == "claimed":
+                        print(f"Reclaiming {key} from {unit['owner']}")
+                    unit.update(state="claimed", owner=self.owner, heartbeat=now)
+                    self._write(manifest)
+                    self.claimed.add(key)
+                    return tuple(unit["job"])
+        return None
+
+    def _set(self, job, state):
+        key = self.key(job)
+        self.claimed.discard(key)
+        with self.lock():
+            manifest = self._read()
+            manifest[key].update(state=state, owner=self.owner, heartbeat=time.time())
+            self._write(manifest)
+
+    def complete(self, job):
+        self._set(job, "done")
+
+    def fail(self, job):
+        # failed jobs are not handed out again, set them back to "pending" in the manifest to retry
+        self._set(job, "failed")
+
+    def _beat(self):
+        while not self.stop.wait(self.lease / 4):
+            claimed = set(self.claimed)
+            if not claimed:
+                continue
+            with self.lock():
+                manifest = self._read()
+                for key in claimed:
+                    if manifest[key]["owner"] == self.owner and manifest[key]["state"] == "claimed":
+                        manifest[key]["heartbeat"] = time.time()
+                self._write(manifest)
+
+    def close(self):
+        self.stop.set()
+        self.heartbeat.join()
+
+
+def run_trials(run, jobs, workers=1, threads=None, queue=None):
+    """
+    Run run(*job) for every job.
+
+    Args:
+        run: Picklable function training one job, e.g. main.run_trial
+        jobs: Argument tuples, one per (model, trial)
+        workers: Number of worker processes, 1 runs every job in this process
+        threads: Intra-op threads per worker (cores divided by workers by default)
+        queue: WorkQueue to take the jobs from instead of the jobs list
+
+    Returns:
+        The jobs that raised, with their exception
+    """
+    failed = []
+    if queue is not None:
+        next_job = queue.claim
+    else:
+        remaining = iter(jobs)
+        next_job = lambda: next(remaining, None)
+
+    def finish(job, error=None):
+        if error is not None:
+            print(f"Job {job} failed: {error!r}")
+            failed.append((job, error))
+            if queue is not None:
+                queue.fail(job)
+        else:
+            print(f"Job {job} done")
+            if queue is not None:
+                queue.complete(job)
+
+    if workers <= 1:
+        while (job := next_job()) is not None:
+            try:
+                run(*job)
+            except Exception as error:
+                if queue is None: # a plain sweep stops at the first error, as before
+                    raise
+                finish(job, error)
+                continue
+            finish(job)
+        return failed
+
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    # spawn: CUDA cannot be re-initialized in a forked worker
+    context = mp.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(threads,)) as pool:
+        running = {}
+        # claim jobs one at a time as workers free up, so other machines can take the rest
+        while True:
+            while len(running) < workers and (job := next_job()) is not None:
+                running[pool.submit(run, *job)] = job
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                error = future.exception()
+                finish(job, error)
+    return failed
@@ -0,0 +1,193 @@
+'''
+
+Generated continual learning task streams on top of dataset.py
+
+Permuted, split (class subsets) and rotated variants of a base dataset are
+defined lazily: every task is a view of the shared base tensors plus a few
+index tensors (a pixel gather map and/or the rows of the selected classes)
+that are applied per batch. A 50-task permuted-MNIST sequence therefore costs
+the memory of one dataset plus 50 index arrays of 784 entries.
+
+Task codes (usable in the datasets list of main.py next to 'm', 'f', 'c', 's'):
+    p<base><seed>      permuted pixels, e.g. 'pm3' is MNIST with permutation seed 3
+    r<base><degrees>   rotated images, e.g. 'rf45' is FashionMNIST rotated by 45 degrees
+    s<base><classes>   class subset, e.g. 'sm01' is MNIST restricted to digits 0 and 1
+
+'''
+
+import math
+import re
+
+import torch
+
+from dataset import MyClassification, load_dataset, registry
+
+
+_SHAPES = {'m': (1, 28, 28), 'f': (1, 28, 28), 'c': (3, 32, 32)}
+_TASK = re.compile(r'^([prs])([mfc])(\d+)$')
+
+
+class TaskView(MyClassification):
+    """
+    Lazily transformed view of a base dataset.
+
+    Attributes:
+        base: MyClassification holding the shared tensors
+        rows: Optional LongTensor of the base rows that belong to the task
+        pixels: Optional LongTensor [H*W] mapping each output pixel to a source
+            pixel (-1 for pixels that fall outside the image), shared by all channels
+        channels: Number of image channels of the base features
+    """
+    def __init__(self, base, rows=None, pixels=None, channels=1):
+        self.base = base
+        self.X = base.X
+        self.y = base.y
+        self.mean = base.mean
+        self.std = base.std
+        self.rows = rows
+        self.pixels = pixels
+        self.channels = channels
+        if pixels is not None:
+            self.valid = pixels >= 0
+            self.source = pixels.clamp(min=0)
+
+    def __len__(self):
+        return len(self.base) if self.rows is None else len(self.rows)
+
+    def __getitem__(self, index):
+        x, y = self.batch(torch.tensor([index]))
+        return x[0], y[0]
+
+    def normalize(self, x):
+        return self.base.normalize(x)
+
+    def _background(self, x):
+        # value of a black pixel in the storage of the base features
+        if x.dtype == torch.uint8:
+            return torch.zeros((), dtype=x.dtype)
+        mean = torch.tensor(self.mean, dtype=x.dtype).reshape(-1, 1)
+        std = torch.tensor(self.std, dtype=x.dtype).reshape(-1, 1)
+        return -mean / std
+
+    def _move_pixels(self, x):
+        flat = x.reshape(len(x), self.channels, -1)
+        out = flat.index_select(2, self.source)
+        out = torch.where(self.valid, out, self._background(x))
+        return out.reshape(x.shape)
+
+    def batch(self, index, pin_memory=False):
+        if self.rows is not None:
+            index = self.rows[index]
+        if self.pixels is None:
+            return self.base.batch(index, pin_memory)
+        # move the pixels in the storage dtype (uint8 for compact stores), then normalize
+        if isinstance(index, slice):
+            x, y = self.X[index], self.y[index]
+        else:
+            x, y = self.X.index_select(0, index), self.y.index_select(0, index)
+        return self.normalize(self._move_pixels(x)), y
+
+    def pin_memory(self):
+        self.base.pin_memory()
+        self.X, self.y = self.base.X, self.base.y
+        return self
+
+
+def permutation(num_pixels, seed):
+    """
+    Fixed pixel permutation of a permuted-MNIST style task.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randperm(num_pixels, generator=generator)
+
+
+def rotation(height, width, degrees):
+    """
+    Nearest-neighbour gather map that rotates an image about its centre.
+
+    Returns:
+        LongTensor [H*W] with the source pixel of each output pixel, -1 outside the image
+    """
+    theta = math.radians(degrees)
+    rows, cols = torch.meshgrid(torch.arange(height, dtype=torch.float32),
+                                torch.arange(width, dtype=torch.float32), indexing='ij')
+    cy, cx = (height - 1) / 2, (width - 1) / 2
+    # inverse rotation: where does every output pixel come from
+    src_y = torch.round(math.cos(theta) * (rows - cy) - math.sin(theta) * (cols - cx) + cy).long()
+    src_x = torch.round(math.sin(theta) * (rows - cy) + math.cos(theta) * (cols - cx) + cx).long()
+    inside = (src_y >= 0) & (src_y < height) & (src_x >= 0) & (src_x < width)
+    return torch.where(inside, src_y * width + src_x, -1).reshape(-1)
+
+
+def class_rows(labels, classes):
+    """
+    Rows of a dataset whose label is one of classes (labels may be one-hot).
+    """
+    if labels.dim() > 1:
+        labels = labels.argmax(dim=1)
+    return torch.isin(labels, torch.tensor(classes)).nonzero().squeeze(1)
+
+
+def is_task(code):
+    return _TASK.match(code) is not None
+
+
+def _make_task(code, test, flavor, compact):
+    kind, base, arg = _TASK.match(code).groups()
+    channels, height, width = _SHAPES[base]
+    sets = load_dataset(base, test, flavor, compact)
+    if kind == 'p':
+        pixels = permutation(height * width, int(arg))
+        return tuple(TaskView(s, pixels=pixels, channels=channels) for s in sets)
+    if kind == 'r':
+        pixels = rotation(height, width, int(arg))
+        return tuple(TaskView(s, pixels=pixels, channels=channels) for s in sets)
+    classes = [int(c) for c in arg]
+    return tuple(TaskView(s, rows=class_rows(s.y, classes), channels=channels) for s in sets)
+
+
+def load_task(code, test=False, flavor='flat', compact=False):
+    """
+    Fetch a generated task (see the module docstring for the codes) through the
+    dataset registry.
+
+    Args:
+        code: Task code such as 'pm3', 'rm45' or 'sm01'
+        test, flavor, compact: As for dataset.load_dataset
+
+    Returns:
+        Tuple of TaskView datasets, shaped like the load_dataset result for the flavor
+    """
+    if not is_task(code):
+        raise ValueError(f"Unkown task \"{code}\". Please use p<base><seed>, r<base><degrees> or s<base><classes> with base 'm', 'f' or 'c'.")
+    return registry.get((code, test, flavor, compact), lambda: _make_task(code, test, flavor, compact))
+
+
+def task_dims(code):
+    """
+    Input and output dimensions of a generated task.
+    """
+    channels, height, width = _SHAPES[_TASK.match(code).group(2)]
+    return channels * height * width, 10
+
+
+def permuted_stream(num_tasks, base='m'):
+    """
+    Task codes of a permuted sequence, e.g. permuted_stream(3) == ['pm1', 'pm2', 'pm3'].
+    """
+    return [f'p{base}{seed}' for seed in range(1, num_tasks + 1)]
+
+
+def rotated_stream(num_tasks, step=15, base='m'):
+    """
+    Task codes of a rotated sequence, e.g. rotated_stream(3) == ['rm0', 'rm15', 'rm30'].
+    """
+    return [f'r{base}{step * t}' for t in range(num_tasks)]
+
+
+def split_stream(classes_per_task=2, base='m', num_classes=10):
+    """
+    Task codes of a split sequence, e.g. split_stream() == ['sm01', 'sm23', 'sm45', 'sm67', 'sm89'].
+    """
+    return [f's{base}' + ''.join(str(c) for c in range(start, start + classes_per_task))
+            for start in range(0, num_classes, classes_per_task)]